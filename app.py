@@ -1,26 +1,36 @@
 import asyncio
+import os
 import signal
 from datetime import datetime
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from sqlmodel import SQLModel
 
-from utils import engine
+from utils import DATABASE_PATH, HTML_FILE
+from utils.fetch import close_client
 from utils.logs import configure_logging, logger
-from utils.utils import init_service, update_all_posts
-
-configure_logging()
-SQLModel.metadata.create_all(bind=engine)
+from utils.models import init_db
+from utils.parse import shutdown_executor
+from utils.schedule import SCHEDULER_TICK
+from utils.utils import init_service, update_all_posts, update_served_files
 
 
 async def main():
-	await init_service()
+	# Here rather than at import: parse workers re-import this module as __mp_main__
+	# (forkserver/spawn), and must not open the store or reconfigure logging.
+	configure_logging()
+	init_db()
+	init_service()
+
+	# Publish straight away, before any fetch: from the persisted posts if there is a
+	# store, or an empty shell so the server and the healthcheck answer immediately.
+	if DATABASE_PATH or not os.path.exists(HTML_FILE):
+		await update_served_files()
 
 	scheduler = AsyncIOScheduler()
 	scheduler.add_job(
 		update_all_posts,
 		'interval',
-		minutes=15,
+		seconds=SCHEDULER_TICK,
 		max_instances=1,
 		next_run_time=datetime.now(),
 	)
@@ -58,6 +68,8 @@ async def main():
 			server_process.terminate()
 			await server_process.wait()
 		monitor_task.cancel()
+		await close_client()
+		shutdown_executor()
 		logger.info('Shutdown complete')
 
 
@@ -0,0 +1,418 @@
+# Offline benchmark of the ingest → store → render pipeline.
+#
+# Serves synthetic RSS and Atom feeds from a local HTTP server running in its own
+# process, then runs a few update_all_posts cycles against them in a scratch
+# directory, and prints per-stage wall time, peak RSS, SQL statement counts and
+# bytes published as JSON, so runs can be diffed to spot regressions:
+#
+#   python3 build_tools/bench_pipeline.py --feeds 50 500 5000 --output bench.json
+import argparse
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+from email.utils import formatdate
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Feed behaviour by index % CASE_PERIOD; every other feed is well behaved
+CASE_PERIOD = 40
+CASES = {
+	0: 'truncated',
+	1: 'slow',
+	2: 'timeout',
+	3: 'no_validators',
+	20: 'not_a_feed',
+	21: 'slow',
+	22: 'timeout',
+	23: 'no_validators',
+}
+SLOW_DELAY = (0.2, 2.0)
+
+# Share of feeds that publish a new entry between two cycles
+PUBLISH_RATE = 0.2
+
+SUMMARY = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 5
+
+
+def feed_case(index: int) -> str:
+	return CASES.get(index % CASE_PERIOD, 'normal')
+
+
+class Fixtures:
+	"""Deterministic feed contents: the same seed always serves the same bytes."""
+
+	def __init__(self, seed: int, min_entries: int, max_entries: int, start: float):
+		self.seed = seed
+		self.min_entries = min_entries
+		self.max_entries = max_entries
+		# Entries predating the run are spread back from an hour before it started
+		self.start = start - 3600
+
+	def shape(self, index: int) -> tuple[int, int, float]:
+		"""Return the entry count, seconds between entries and age of the newest entry."""
+		rng = random.Random(f'{self.seed}-{index}')
+		spacing = rng.randint(300, 4 * 3600)
+		return rng.randint(self.min_entries, self.max_entries), spacing, rng.uniform(0, spacing)
+
+	def version(self, index: int, cycle: int) -> int:
+		"""Return how many entries the feed has published since the first cycle."""
+		return sum(
+			random.Random(f'{self.seed}-{index}-{c}').random() < PUBLISH_RATE
+			for c in range(2, cycle + 1)
+		)
+
+	def entries(self, index: int, version: int) -> list[tuple[int, float]]:
+		"""Return (number, timestamp) of the entries served, newest first."""
+		count, spacing, offset = self.shape(index)
+		newest = self.start - offset
+		entries = []
+		for number in range(version + count - 1, version - 1, -1):
+			if number >= count:
+				# Published during the run, a minute apart
+				timestamp = self.start + (number - count + 1) * 60
+			else:
+				timestamp = newest - (count - 1 - number) * spacing
+			entries.append((number, timestamp))
+		return entries
+
+	def render(self, index: int, version: int) -> bytes:
+		entries = self.entries(index, version)
+		site = f'https://feed{index}.bench'
+		if index % 2:
+			items = ''.join(
+				f'<entry><title>Article {number} du flux {index}</title>'
+				f'<link href="{site}/{number}"/><id>{site}/{number}</id>'
+				f'<updated>{datetime.fromtimestamp(timestamp, UTC).isoformat()}</updated>'
+				f'<summary>{SUMMARY}</summary></entry>'
+				for number, timestamp in entries
+			)
+			document = (
+				'<?xml version="1.0" encoding="utf-8"?>'
+				'<feed xmlns="http://www.w3.org/2005/Atom">'
+				f'<title>Flux {index}</title><link href="{site}/"/><id>{site}/</id>'
+				f'<updated>{datetime.fromtimestamp(entries[0][1], UTC).isoformat()}</updated>'
+				f'{items}</feed>'
+			)
+		else:
+			items = ''.join(
+				f'<item><title>Article {number} du flux {index}</title>'
+				f'<link>{site}/{number}</link><guid>{site}/{number}</guid>'
+				f'<pubDate>{formatdate(timestamp, usegmt=True)}</pubDate>'
+				f'<description>{SUMMARY}</description></item>'
+				for number, timestamp in entries
+			)
+			document = (
+				'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+				f'<title>Flux {index}</title><link>{site}/</link>'
+				f'<description>Flux de test {index}</description>{items}</channel></rss>'
+			)
+
+		body = document.encode()
+		case = feed_case(index)
+		if case == 'truncated':
+			return body[: len(body) * 2 // 3]
+		if case == 'not_a_feed':
+			return b'<!doctype html><html><body><h1>Maintenance</h1></body></html>'
+		return body
+
+
+async def _serve(fixtures: Fixtures, cycle, port_queue) -> None:
+	compressed: dict[tuple[int, int], bytes] = {}
+
+	async def respond(writer, status: str, headers: dict[str, str], body: bytes = b''):
+		headers['Content-Length'] = str(len(body))
+		head = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+		writer.write(f'HTTP/1.1 {status}\r\n{head}\r\n'.encode() + body)
+		await writer.drain()
+
+	async def handle(reader, writer) -> None:
+		try:
+			while True:
+				request = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+				path = request[0].split(' ')[1]
+				headers = {}
+				for line in request[1:]:
+					name, _, value = line.partition(':')
+					headers[name.strip().lower()] = value.strip()
+
+				try:
+					index = int(path.removeprefix('/feeds/').removesuffix('.xml'))
+				except ValueError:
+					await respond(writer, '404 Not Found', {})
+					continue
+
+				case = feed_case(index)
+				if case == 'timeout':
+					await asyncio.sleep(3600)
+				if case == 'slow':
+					await asyncio.sleep(random.Random(index).uniform(*SLOW_DELAY))
+
+				version = fixtures.version(index, cycle.value)
+				response_headers = {'Content-Type': 'application/xml; charset=utf-8'}
+				if case != 'no_validators':
+					etag = f'"{index}-{version}"'
+					if headers.get('if-none-match') == etag:
+						await respond(writer, '304 Not Modified', {'ETag': etag})
+						continue
+					response_headers['ETag'] = etag
+
+				if 'gzip' in headers.get('accept-encoding', ''):
+					key = (index, version)
+					if key not in compressed:
+						compressed[key] = gzip.compress(fixtures.render(index, version), 6)
+					body = compressed[key]
+					response_headers['Content-Encoding'] = 'gzip'
+				else:
+					body = fixtures.render(index, version)
+				await respond(writer, '200 OK', response_headers, body)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	server = await asyncio.start_server(handle, '127.0.0.1', 0, backlog=1024)
+	port_queue.put(server.sockets[0].getsockname()[1])
+	async with server:
+		await server.serve_forever()
+
+
+def serve(fixtures: Fixtures, cycle, port_queue) -> None:
+	asyncio.run(_serve(fixtures, cycle, port_queue))
+
+
+def _workers_peak_rss(exclude: int) -> int:
+	"""Sum the peak RSS in KiB of this process's children, e.g. the parse workers."""
+	total = 0
+	for pid in filter(str.isdigit, os.listdir('/proc')):
+		try:
+			with open(f'/proc/{pid}/stat') as f:
+				parent = int(f.read().rsplit(')', 1)[1].split()[1])
+			if parent != os.getpid() or int(pid) == exclude:
+				continue
+			with open(f'/proc/{pid}/status') as f:
+				for line in f:
+					if line.startswith('VmHWM:'):
+						total += int(line.split()[1])
+		except (OSError, ValueError, IndexError):
+			continue
+	return total
+
+
+def prepare_workdir(work_dir: str, port: int, feeds: int) -> None:
+	"""Lay out what the app reads from its working directory."""
+	shutil.copytree(
+		os.path.join(REPO_DIR, 'templates'),
+		os.path.join(work_dir, 'templates'),
+		ignore=shutil.ignore_patterns('.cache'),
+	)
+	inline_style = os.path.join(work_dir, 'templates', 'inline_style.html')
+	if not os.path.exists(inline_style):
+		# Generated by compress_all.py; its content doesn't matter here
+		with open(inline_style, 'w') as f:
+			f.write('<style></style>')
+
+	for path in ('css/daisy.min.css', 'js/index.min.js', 'csp-hash.txt'):
+		os.makedirs(os.path.join(work_dir, 'static', os.path.dirname(path)), exist_ok=True)
+		shutil.copy(os.path.join(REPO_DIR, 'static', path), os.path.join(work_dir, 'static', path))
+
+	with open(os.path.join(work_dir, 'gazette.toml'), 'w') as f:
+		for index in range(feeds):
+			f.write(
+				'[[feeds.feedlist]]\n'
+				f'link = "http://127.0.0.1:{port}/feeds/{index}.xml"\n'
+				f'domain = "feed{index}.bench"\n'
+				f'title = "Flux {index}"\n'
+			)
+
+
+async def run_cycles(args, cycle, server_pid: int) -> list[dict]:
+	from sqlalchemy import event, func
+	from sqlmodel import Session, select, update
+
+	import utils.fetch
+	import utils.models
+	import utils.utils
+	from utils import engine
+	from utils.fetch import close_client
+	from utils.models import Feed, Post, init_db
+	from utils.parse import shutdown_executor
+
+	# Fail the deliberately hanging feeds quickly instead of after the production timeout
+	utils.fetch.FEED_TIMEOUT = args.timeout
+	utils.models.PROBE_TIMEOUT = args.timeout
+
+	counters = {'statements': 0, 'render_statements': 0, 'bytes': 0, 'files': 0}
+	rendering = False
+
+	@event.listens_for(engine, 'before_cursor_execute')
+	def count_statement(*_):
+		counters['render_statements' if rendering else 'statements'] += 1
+
+	publish = utils.utils.publish
+	update_served_files = utils.utils.update_served_files
+	render_time = 0.0
+
+	async def counting_publish(files: dict[str, bytes]) -> None:
+		counters['files'] += len(files)
+		counters['bytes'] += sum(map(len, files.values()))
+		await publish(files)
+
+	async def timed_update_served_files() -> None:
+		nonlocal rendering, render_time
+		rendering = True
+		start = time.perf_counter()
+		try:
+			await update_served_files()
+		finally:
+			render_time += time.perf_counter() - start
+			rendering = False
+
+	utils.utils.publish = counting_publish
+	utils.utils.update_served_files = timed_update_served_files
+
+	def measure(stage: str, wall: float) -> dict:
+		with Session(engine) as session:
+			posts = session.exec(select(func.count()).select_from(Post)).one()
+			failing = session.exec(
+				select(func.count()).select_from(Feed).where(Feed.failure_count > 0)
+			).one()
+		result = {
+			'stage': stage,
+			'wall_s': round(wall, 4),
+			'ingest_s': round(wall - render_time, 4),
+			'render_s': round(render_time, 4),
+			'statements': counters['statements'],
+			'render_statements': counters['render_statements'],
+			'files_written': counters['files'],
+			'bytes_written': counters['bytes'],
+			'posts': posts,
+			'failing_feeds': failing,
+			'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+			'workers_peak_rss_kib': _workers_peak_rss(exclude=server_pid),
+		}
+		for key in counters:
+			counters[key] = 0
+		return result
+
+	stages = []
+	try:
+		start = time.perf_counter()
+		init_db()
+		utils.utils.init_service()
+		await utils.utils.update_served_files()
+		stages.append(measure('startup', time.perf_counter() - start))
+
+		for number in range(1, args.cycles + 1):
+			cycle.value = number
+			render_time = 0.0
+			# Every feed is due, so each cycle does the same amount of work across runs
+			with Session(engine) as session:
+				session.exec(update(Feed).values(next_fetch=None))
+				session.commit()
+			counters['statements'] = 0
+
+			start = time.perf_counter()
+			await utils.utils.update_all_posts()
+			stages.append(measure(f'cycle-{number}', time.perf_counter() - start))
+	finally:
+		await close_client()
+		shutdown_executor()
+	return stages
+
+
+def run(args) -> dict:
+	"""Benchmark a single feed count in this process."""
+	fixtures = Fixtures(args.seed, args.min_entries, args.max_entries, time.time())
+	cycle = multiprocessing.Value('i', 1)
+	port_queue = multiprocessing.Queue()
+	server = multiprocessing.Process(target=serve, args=(fixtures, cycle, port_queue), daemon=True)
+	server.start()
+	port = port_queue.get(timeout=10)
+
+	with tempfile.TemporaryDirectory(prefix='gazette-bench-') as work_dir:
+		prepare_workdir(work_dir, port, args.feeds[0])
+		os.chdir(work_dir)
+		if not args.memory:
+			os.environ['DATABASE_PATH'] = os.path.join(work_dir, 'gazette.db')
+		os.environ.setdefault('LOGLEVEL', 'CRITICAL')
+		sys.path.insert(0, REPO_DIR)
+
+		from utils.logs import configure_logging
+
+		configure_logging()
+		try:
+			stages = asyncio.run(run_cycles(args, cycle, server.pid))
+		finally:
+			os.chdir(REPO_DIR)
+			server.terminate()
+
+	cases: dict[str, int] = {}
+	for index in range(args.feeds[0]):
+		cases[feed_case(index)] = cases.get(feed_case(index), 0) + 1
+	return {
+		'feeds': args.feeds[0],
+		'entries_served': sum(fixtures.shape(index)[0] for index in range(args.feeds[0])),
+		'cases': cases,
+		'stages': stages,
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='Offline ingest → store → render benchmark')
+	parser.add_argument('--feeds', type=int, nargs='+', default=[50, 500, 5000])
+	parser.add_argument('--min-entries', type=int, default=10)
+	parser.add_argument('--max-entries', type=int, default=500)
+	parser.add_argument('--cycles', type=int, default=3)
+	parser.add_argument('--timeout', type=float, default=5.0, help='fetch timeout in seconds')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--memory', action='store_true', help='use the in-memory database')
+	parser.add_argument('--output', help='write the JSON report here instead of stdout')
+	args = parser.parse_args()
+
+	if len(args.feeds) == 1:
+		results = [run(args)]
+	else:
+		# One process per size, so each starts cold and peak RSS isn't shared
+		results = []
+		for feeds in args.feeds:
+			argv = [sys.executable, os.path.abspath(__file__), '--feeds', str(feeds)]
+			for option in ('min_entries', 'max_entries', 'cycles', 'timeout', 'seed'):
+				argv += [f'--{option.replace("_", "-")}', str(getattr(args, option))]
+			if args.memory:
+				argv.append('--memory')
+			output = subprocess.run(argv, check=True, capture_output=True, text=True).stdout
+			results += json.loads(output)['results']
+
+	report = {
+		'date': datetime.now(UTC).isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'settings': {
+			'min_entries': args.min_entries,
+			'max_entries': args.max_entries,
+			'cycles': args.cycles,
+			'timeout_s': args.timeout,
+			'seed': args.seed,
+			'database': 'memory' if args.memory else 'file',
+		},
+		'results': results,
+	}
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+	else:
+		print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+	main()
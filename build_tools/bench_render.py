@@ -0,0 +1,57 @@
+# Compares the CPU cost of building the home page the old way (source templates,
+# then minify_html on every render) with minified templates and no runtime minify.
+import os
+import shutil
+import tempfile
+import time
+
+import minify_html
+from jinja2 import Environment, FileSystemLoader
+from minify_templates import (
+	TEMPLATES_DIR,
+	create_environment,
+	minify_templates,
+	render_fragments,
+	render_page,
+)
+
+POSTS = 300
+ROUNDS = 50
+
+
+def cpu_per_render(render) -> tuple[float, int]:
+	render()  # compile the templates before timing
+	start = time.process_time()
+	for _ in range(ROUNDS):
+		html = render()
+	return (time.process_time() - start) / ROUNDS * 1000, len(html.encode())
+
+
+with tempfile.TemporaryDirectory() as work_dir:
+	source_dir = os.path.join(work_dir, 'source')
+	minified_dir = os.path.join(work_dir, 'minified')
+	for directory in (source_dir, minified_dir):
+		shutil.copytree(TEMPLATES_DIR, directory)
+		# Generated by compress_all.py; a placeholder is enough to time the render
+		if not os.path.exists(os.path.join(directory, 'inline_style.html')):
+			with open(os.path.join(directory, 'inline_style.html'), 'w') as f:
+				f.write('<style></style>')
+	minify_templates(minified_dir)
+
+	source_env = Environment(loader=FileSystemLoader(source_dir))
+	minified_env = create_environment(minified_dir)
+
+	# Post cards come from the fragment cache in production, so only the page is timed
+	source_cards = render_fragments(source_env, POSTS)
+	minified_cards = render_fragments(minified_env, POSTS)
+
+	before = cpu_per_render(
+		lambda: minify_html.minify(
+			render_page(source_env, '', source_cards), minify_css=False, minify_js=True
+		)
+	)
+	after = cpu_per_render(lambda: render_page(minified_env, '', minified_cards))
+
+print(f'{POSTS} posts, {ROUNDS} rounds')
+print(f'render + minify_html:  {before[0]:.2f} ms CPU, {before[1]} bytes')
+print(f'minified templates:    {after[0]:.2f} ms CPU, {after[1]} bytes')
@@ -0,0 +1,56 @@
+# Packs the 32×32 source favicons into a single AVIF sprite and writes the CSS that
+# maps each domain to its tile, so the home page loads one image instead of one per source.
+import hashlib
+import math
+import os
+
+from PIL import Image
+
+FAVICONS_DIR = os.path.join('static', 'favicons')
+SPRITE_NAME = 'sprite.avif'
+CSS_PATH = os.path.join('static', 'css', 'favicons.css')
+TILE = 32
+# Size on the page in CSS pixels; tiles are twice that for high-density screens
+DISPLAY = 16
+
+
+def build_sprite() -> int:
+	"""Build the sprite and its CSS from static/favicons and return the number of icons."""
+	domains = sorted(
+		name.removesuffix('.avif')
+		for name in os.listdir(FAVICONS_DIR)
+		if name.endswith('.avif') and not name.endswith('-large.avif') and name != SPRITE_NAME
+	)
+	if not domains:
+		return 0
+
+	columns = math.ceil(math.sqrt(len(domains)))
+	rows = math.ceil(len(domains) / columns)
+	sprite = Image.new('RGBA', (columns * TILE, rows * TILE))
+	rules = []
+	for index, domain in enumerate(domains):
+		column, row = index % columns, index // columns
+		with Image.open(os.path.join(FAVICONS_DIR, f'{domain}.avif')) as icon:
+			sprite.paste(icon.convert('RGBA').resize((TILE, TILE)), (column * TILE, row * TILE))
+		rules.append(
+			f'[data-favicon="{domain}"]'
+			f'{{background-position:-{column * DISPLAY}px -{row * DISPLAY}px}}'
+		)
+
+	sprite_path = os.path.join(FAVICONS_DIR, SPRITE_NAME)
+	sprite.save(sprite_path, 'AVIF')
+	with open(sprite_path, 'rb') as f:
+		sprite_hash = hashlib.md5(f.read()).hexdigest()[:8]
+
+	css = (
+		f'.favicon{{display:inline-block;flex:none;width:{DISPLAY}px;height:{DISPLAY}px;'
+		f'background:url(/favicons/{SPRITE_NAME}?v={sprite_hash}) no-repeat;'
+		f'background-size:{columns * DISPLAY}px {rows * DISPLAY}px}}'
+	) + ''.join(rules)
+	with open(CSS_PATH, 'w') as f:
+		f.write(css)
+	return len(domains)
+
+
+if __name__ == '__main__':
+	print(f'Packed {build_sprite()} favicons into {os.path.join(FAVICONS_DIR, SPRITE_NAME)}.')
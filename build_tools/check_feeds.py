@@ -1,50 +1,270 @@
+# Performance audit of the feeds in gazette.toml.
+#
+# Fetches every feed concurrently and reports time to first byte, total time, bytes on
+# the wire and once decompressed, entry count, redirects, and whether a second request
+# with the feed's ETag/Last-Modified actually gets a 304. Prints a table sorted by the
+# chosen column and optionally writes the full report as JSON:
+#
+#   python3 build_tools/check_feeds.py --sort compressed_bytes --output feeds.json
+#
+# --fixtures N checks N synthetic feeds served by bench_pipeline.py's fixture server
+# instead, which needs no network. Exits with status 1 if any feed failed, apart from
+# the fixtures that are broken on purpose (hanging, truncated or not a feed).
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
 import tomllib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from io import BytesIO
+from urllib.parse import urlsplit
 
 import feedparser
+import httpx
 
 TIMEOUT = 15
+CONCURRENCY = 10
+PER_HOST = 2
 USER_AGENT = 'Mozilla/5.0 (compatible; Gazette/1.0; +https://github.com)'
 
-with open('gazette.toml', 'rb') as f:
-	config = tomllib.load(f)
+SORT_KEYS = ('total_ms', 'ttfb_ms', 'compressed_bytes', 'uncompressed_bytes', 'entries')
 
-feeds = config['feeds']['feedlist']
-print(f'Checking {len(feeds)} feeds…\n')
+# bench_pipeline.py fixture cases that are meant to fail
+FAILING_CASES = ('timeout', 'truncated', 'not_a_feed')
 
-errors = []
 
+@dataclass
+class FeedReport:
+	title: str
+	url: str
+	status: int | None = None
+	# One {'status', 'url', 'location'} per redirect followed, in order
+	redirects: list[dict] = field(default_factory=list)
+	ttfb_ms: float | None = None
+	total_ms: float | None = None
+	content_encoding: str | None = None
+	compressed_bytes: int | None = None
+	uncompressed_bytes: int | None = None
+	entries: int | None = None
+	etag: bool = False
+	last_modified: bool = False
+	# '304', 'ignored' (validators sent back but full response) or 'no validators'
+	conditional: str | None = None
+	error: str | None = None
+	# Failure doesn't count against the exit status (broken fixtures)
+	may_fail: bool = False
 
-def check_feed(feed):
-	title = feed['title']
+
+async def timed_get(client: httpx.AsyncClient, url: str, headers: dict[str, str]):
+	"""Return the response, its decoded body, and the seconds to headers and to the last byte."""
+	start = time.perf_counter()
+	async with client.stream('GET', url, headers=headers) as response:
+		ttfb = time.perf_counter() - start
+		body = b''.join([chunk async for chunk in response.aiter_bytes()])
+	return response, body, ttfb, time.perf_counter() - start
+
+
+async def check_feed(
+	feed: dict,
+	client: httpx.AsyncClient,
+	slots: asyncio.Semaphore,
+	host_slots: dict[str, asyncio.Semaphore],
+	timeout: float,
+) -> FeedReport:
 	url = feed['link']
+	report = FeedReport(title=feed.get('title', url), url=url, may_fail=feed.get('may_fail', False))
+	host_slot = host_slots.setdefault(urlsplit(url).hostname or '', asyncio.Semaphore(PER_HOST))
 	try:
-		result = feedparser.parse(
-			url,
-			request_headers={'User-Agent': USER_AGENT},
+		# Timers and timeouts start once both slots are held, so queueing isn't reported
+		# as latency. The host slot comes first, as in utils/fetch.py.
+		async with host_slot, slots:
+			response, body, ttfb, total = await asyncio.wait_for(
+				timed_get(client, url, {}), timeout
+			)
+		report.status = response.status_code
+		report.redirects = [
+			{
+				'status': hop.status_code,
+				'url': str(hop.url),
+				'location': hop.headers.get('location'),
+			}
+			for hop in response.history
+		]
+		report.ttfb_ms = round(ttfb * 1000, 1)
+		report.total_ms = round(total * 1000, 1)
+		response.raise_for_status()
+
+		report.content_encoding = response.headers.get('content-encoding')
+		report.compressed_bytes = response.num_bytes_downloaded
+		report.uncompressed_bytes = len(body)
+		parse_headers = {'content-location': str(response.url)}
+		if 'content-type' in response.headers:
+			parse_headers['content-type'] = response.headers['content-type']
+		result = await asyncio.to_thread(
+			feedparser.parse, BytesIO(body), response_headers=parse_headers
 		)
+		report.entries = len(result.entries)
 		if result.bozo and not result.entries:
-			return (title, url, f'Parse error: {result.bozo_exception}')
-		if not result.entries:
-			return (title, url, 'No entries found')
-		return (title, url, None)
-	except Exception as e:
-		return (title, url, str(e))
-
-
-with ThreadPoolExecutor(max_workers=10) as pool:
-	futures = {pool.submit(check_feed, feed): feed for feed in feeds}
-	for future in as_completed(futures):
-		title, url, error = future.result()
-		if error:
-			errors.append((title, url, error))
-			print(f'  FAIL  {title} — {error}')
-		else:
-			print(f'  OK    {title}')
-
-print(f'\n{len(feeds) - len(errors)}/{len(feeds)} feeds OK.')
-if errors:
-	print(f'{len(errors)} feed(s) with errors:')
-	for title, url, error in errors:
-		print(f'  - {title}: {url}')
-		print(f'    {error}')
+			report.error = f'Parse error: {result.bozo_exception}'
+		elif not result.entries:
+			report.error = 'No entries found'
+
+		# Ask again with the validators, the way the scheduler does on the next cycle
+		etag = response.headers.get('etag')
+		modified = response.headers.get('last-modified')
+		report.etag, report.last_modified = etag is not None, modified is not None
+		conditional_headers = {}
+		if etag:
+			conditional_headers['If-None-Match'] = etag
+		if modified:
+			conditional_headers['If-Modified-Since'] = modified
+		if not conditional_headers:
+			report.conditional = 'no validators'
+			return report
+		async with host_slot, slots:
+			second, *_ = await asyncio.wait_for(
+				timed_get(client, url, conditional_headers), timeout
+			)
+		report.conditional = '304' if second.status_code == 304 else 'ignored'
+	except (TimeoutError, httpx.TimeoutException):
+		report.error = f'Timed out after {timeout:g}s'
+	except httpx.HTTPError as e:
+		# httpx appends a documentation link on a second line
+		message = str(e).partition('\n')[0]
+		report.error = f'{type(e).__name__}: {message}'
+	return report
+
+
+async def check_feeds(feeds: list[dict], timeout: float) -> list[FeedReport]:
+	slots = asyncio.Semaphore(CONCURRENCY)
+	host_slots: dict[str, asyncio.Semaphore] = {}
+	async with httpx.AsyncClient(
+		http2=True,
+		follow_redirects=True,
+		# The semaphores queue requests, so waiting for a pooled connection never times out
+		timeout=httpx.Timeout(timeout, pool=None),
+		limits=httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY),
+		headers={
+			'User-Agent': USER_AGENT,
+			'Accept': 'application/rss+xml, application/atom+xml, application/xml;q=0.9, */*;q=0.8',
+			'Accept-Encoding': 'br, gzip, deflate',
+		},
+	) as client:
+		return await asyncio.gather(
+			*(check_feed(feed, client, slots, host_slots, timeout) for feed in feeds)
+		)
+
+
+def print_table(reports: list[FeedReport], sort: str) -> None:
+	def cell(value) -> str:
+		return '-' if value is None else str(value)
+
+	# Failed feeds last, the rest with the largest values first
+	ordered = sorted(
+		reports,
+		key=lambda report: (report.error is not None, -(getattr(report, sort) or 0)),
+	)
+	rows = [
+		('Feed', 'Status', 'TTFB ms', 'Total ms', 'Wire KB', 'Raw KB', 'Entries', 'Cond.', 'Redir.')
+	]
+	for report in ordered:
+		rows.append(
+			(
+				report.title[:40],
+				cell(report.status),
+				cell(report.ttfb_ms),
+				cell(report.total_ms),
+				cell(report.compressed_bytes and round(report.compressed_bytes / 1024, 1)),
+				cell(report.uncompressed_bytes and round(report.uncompressed_bytes / 1024, 1)),
+				cell(report.entries),
+				cell(report.conditional),
+				str(len(report.redirects)),
+			)
+		)
+	widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+	for row in rows:
+		# Feed names left-aligned, figures right-aligned
+		print(
+			'  '.join(
+				value.ljust(width) if column == 0 else value.rjust(width)
+				for column, (value, width) in enumerate(zip(row, widths))
+			)
+		)
+
+	failed = [report for report in reports if report.error]
+	print(f'\n{len(reports) - len(failed)}/{len(reports)} feeds OK.')
+	for report in failed:
+		print(f'  - {report.title}: {report.url}' + (' (expected)' if report.may_fail else ''))
+		print(f'    {report.error}')
+
+
+def fixture_feeds(count: int) -> tuple[list[dict], multiprocessing.Process]:
+	"""Start bench_pipeline.py's fixture server and return its feeds and process."""
+	from bench_pipeline import Fixtures, feed_case, serve
+
+	fixtures = Fixtures(seed=1, min_entries=10, max_entries=200, start=time.time())
+	port_queue = multiprocessing.Queue()
+	server = multiprocessing.Process(
+		target=serve, args=(fixtures, multiprocessing.Value('i', 1), port_queue), daemon=True
+	)
+	server.start()
+	port = port_queue.get(timeout=10)
+	feeds = [
+		{
+			'title': f'Flux {index}',
+			'link': f'http://127.0.0.1:{port}/feeds/{index}.xml',
+			'may_fail': feed_case(index) in FAILING_CASES,
+		}
+		for index in range(count)
+	]
+	return feeds, server
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description='Latency, size and validator audit of the feeds')
+	parser.add_argument('--config', default='gazette.toml', help='feed list to check')
+	parser.add_argument(
+		'--fixtures', type=int, metavar='N', help='check N local synthetic feeds instead'
+	)
+	parser.add_argument('--timeout', type=float, default=TIMEOUT, help='per request, in seconds')
+	parser.add_argument('--sort', choices=SORT_KEYS, default='total_ms')
+	parser.add_argument('--output', help='also write the JSON report here')
+	args = parser.parse_args()
+
+	server = None
+	if args.fixtures:
+		feeds, server = fixture_feeds(args.fixtures)
+	else:
+		with open(args.config, 'rb') as f:
+			feeds = tomllib.load(f)['feeds']['feedlist']
+	print(f'Checking {len(feeds)} feeds…\n')
+
+	start = time.perf_counter()
+	try:
+		reports = asyncio.run(check_feeds(feeds, args.timeout))
+	finally:
+		if server is not None:
+			server.terminate()
+	elapsed = time.perf_counter() - start
+
+	print_table(reports, args.sort)
+	print(f'Checked in {elapsed:.1f}s.')
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(
+				{
+					'date': datetime.now(UTC).isoformat(timespec='seconds'),
+					'elapsed_s': round(elapsed, 2),
+					'feeds': [asdict(report) for report in reports],
+				},
+				f,
+				indent=2,
+			)
+	sys.exit(1 if any(report.error and not report.may_fail for report in reports) else 0)
+
+
+if __name__ == '__main__':
+	main()
@@ -3,50 +3,119 @@ import base64
 import gzip
 import hashlib
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import brotli
 
 from csscompressor import compress
 from jsmin import jsmin
+from manifest import Manifest, file_digest
+from minify_templates import minify_and_check
 
-with open('static/js/index.js') as js_file:
-	minified = jsmin(js_file.read())
-	with open('static/js/index.min.js', 'w') as minified_js:
-		minified_js.write(minified)
-
-with open('static/sw.js') as sw_file:
-	sw_content = sw_file.read()
-	# Inject a content-based cache name so the SW busts cache when assets change
-	content_to_hash = b''
-	for asset_path in ['static/css/daisy.min.css', 'static/js/index.min.js']:
-		with open(asset_path, 'rb') as af:
-			content_to_hash += af.read()
-	cache_hash = hashlib.md5(content_to_hash).hexdigest()[:8]
-	sw_content = sw_content.replace('CACHE_PLACEHOLDER', f'gazette-{cache_hash}')
-	minified_sw = jsmin(sw_content)
-	with open('static/sw.js', 'w') as sw_out:
-		sw_out.write(minified_sw)
-
-with open('static/css/style.css', 'r') as css_file:
-	compressed_css: str = compress(css_file.read())
-	with open('static/css/style.min.css', 'w') as minified_css_file:
-		_ = minified_css_file.write(compressed_css)
-	# Generate inline style template for embedding in <head>
-	with open('templates/inline_style.html', 'w') as inline_file:
-		inline_file.write(f'<style>{compressed_css}</style>')
-	# CSP hash of inline style — content only, no <style> tags
-	csp_hash = base64.b64encode(hashlib.sha256(compressed_css.encode()).digest()).decode()
-	with open('static/csp-hash.txt', 'w') as csp_file:
-		csp_file.write(f'sha256-{csp_hash}')
-
-for root, dirs, files in os.walk('static'):
-	for file in files:
-		file_path = os.path.join(root, file)
-		if file.endswith(('.gz', '.br')):
-			continue
-		with open(file_path, 'rb') as f_in:
-			data = f_in.read()
-		with open(file_path + '.gz', 'wb') as f_out:
-			f_out.write(gzip.compress(data))
-		with open(file_path + '.br', 'wb') as f_out:
-			f_out.write(brotli.compress(data, quality=11))
+# Formats that are already compressed: brotli or gzip on top would only waste build time
+PRECOMPRESSED_SUFFIXES = ('.avif', '.woff2', '.png', '.jpg', '.jpeg', '.webp', '.gif')
+SIDECAR_SUFFIXES = ('.br', '.gz')
+
+
+def minify_js() -> None:
+	with open('static/js/index.js') as js_file:
+		minified = jsmin(js_file.read())
+		with open('static/js/index.min.js', 'w') as minified_js:
+			minified_js.write(minified)
+
+
+def build_service_worker() -> None:
+	with open('static/sw.js') as sw_file:
+		sw_content = sw_file.read()
+		# Inject a content-based cache name so the SW busts cache when assets change
+		content_to_hash = b''
+		for asset_path in ['static/css/daisy.min.css', 'static/js/index.min.js']:
+			with open(asset_path, 'rb') as af:
+				content_to_hash += af.read()
+		cache_hash = hashlib.md5(content_to_hash).hexdigest()[:8]
+		sw_content = sw_content.replace('CACHE_PLACEHOLDER', f'gazette-{cache_hash}')
+		minified_sw = jsmin(sw_content)
+		with open('static/sw.js', 'w') as sw_out:
+			sw_out.write(minified_sw)
+
+
+def minify_css() -> None:
+	with open('static/css/style.css', 'r') as css_file:
+		compressed_css: str = compress(css_file.read())
+		with open('static/css/style.min.css', 'w') as minified_css_file:
+			_ = minified_css_file.write(compressed_css)
+		# Generate inline style template for embedding in <head>
+		with open('templates/inline_style.html', 'w') as inline_file:
+			inline_file.write(f'<style>{compressed_css}</style>')
+		# CSP hash of inline style — content only, no <style> tags
+		csp_hash = base64.b64encode(hashlib.sha256(compressed_css.encode()).digest()).decode()
+		with open('static/csp-hash.txt', 'w') as csp_file:
+			csp_file.write(f'sha256-{csp_hash}')
+
+
+def precompress(path: str) -> list[str]:
+	"""Write the .br and .gz sidecars of path, keeping only those smaller than the file."""
+	with open(path, 'rb') as f_in:
+		data = f_in.read()
+
+	written = []
+	for suffix, compressed in (
+		('.br', brotli.compress(data, quality=11)),
+		('.gz', gzip.compress(data)),
+	):
+		if len(compressed) < len(data):
+			with open(path + suffix, 'wb') as f_out:
+				f_out.write(compressed)
+			written.append(path + suffix)
+		elif os.path.exists(path + suffix):
+			os.unlink(path + suffix)
+	return written
+
+
+def precompress_static() -> None:
+	"""Precompress static/ in a process pool, skipping files unchanged since the last run."""
+	manifest = Manifest('precompress')
+	pending: list[tuple[str, str]] = []
+	unchanged = 0
+	for root, dirs, files in os.walk('static'):
+		for file in files:
+			file_path = os.path.join(root, file)
+			if file.endswith(SIDECAR_SUFFIXES):
+				continue
+			if file.endswith(PRECOMPRESSED_SUFFIXES):
+				# Left over from before these formats were skipped
+				for suffix in SIDECAR_SUFFIXES:
+					if os.path.exists(file_path + suffix):
+						os.unlink(file_path + suffix)
+				continue
+
+			digest = file_digest(file_path)
+			if manifest.unchanged(file_path, digest):
+				unchanged += 1
+			else:
+				pending.append((file_path, digest))
+
+	with ProcessPoolExecutor() as pool:
+		paths = [file_path for file_path, _ in pending]
+		for (file_path, digest), outputs in zip(pending, pool.map(precompress, paths)):
+			manifest.record(file_path, digest, outputs)
+	manifest.save()
+	print(f'Precompressed {len(pending)} files, {unchanged} unchanged.')
+
+
+def main() -> None:
+	minify_js()
+	build_service_worker()
+	minify_css()
+
+	# Rewrites the templates in place, so only when building the image, not in a checkout.
+	# Needs inline_style.html and the CSP hash written above.
+	if '--minify-templates' in sys.argv:
+		print(f'Minified {minify_and_check()} templates.')
+
+	precompress_static()
+
+
+if __name__ == '__main__':
+	main()
@@ -1,18 +1,47 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from PIL import Image
 
+from manifest import Manifest, file_digest
+
 icons_dir = os.path.join('static', 'icons')
 
-for filename in os.listdir(icons_dir):
-	if not filename.endswith('.png'):
-		continue
-	png_path = os.path.join(icons_dir, filename)
-	avif_path = os.path.join(icons_dir, filename.removesuffix('.png') + '.avif')
-	if os.path.exists(avif_path):
-		continue
+
+def convert(png_path: str, avif_path: str) -> str | None:
+	"""Encode png_path as AVIF and return an error message on failure."""
 	try:
 		Image.open(png_path).save(avif_path, 'AVIF')
-		print(f'{filename} -> {os.path.basename(avif_path)}')
 	except Exception as e:
-		print(f'Failed to convert {filename}: {e}')
+		return str(e)
+	return None
+
+
+def main() -> None:
+	manifest = Manifest('icons')
+	pending = []
+	for filename in os.listdir(icons_dir):
+		if not filename.endswith('.png'):
+			continue
+		png_path = os.path.join(icons_dir, filename)
+		avif_path = os.path.join(icons_dir, filename.removesuffix('.png') + '.avif')
+		digest = file_digest(png_path)
+		# Existing AVIFs are kept unless their PNG changed since they were recorded
+		if os.path.exists(avif_path) and not manifest.stale(png_path, digest):
+			continue
+		pending.append((png_path, avif_path, digest))
+
+	with ProcessPoolExecutor() as pool:
+		futures = [pool.submit(convert, png_path, avif_path) for png_path, avif_path, _ in pending]
+		for (png_path, avif_path, digest), future in zip(pending, futures):
+			error = future.result()
+			if error:
+				print(f'Failed to convert {os.path.basename(png_path)}: {error}')
+				continue
+			manifest.record(png_path, digest, [avif_path])
+			print(f'{os.path.basename(png_path)} -> {os.path.basename(avif_path)}')
+	manifest.save()
+
+
+if __name__ == '__main__':
+	main()
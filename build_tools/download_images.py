@@ -1,74 +1,212 @@
+import asyncio
+import hashlib
 import os
 import tomllib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from urllib.parse import urlsplit
 
 import cairosvg
-import requests
+import httpx
 from PIL import Image
 
-headers = {
-	'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'
-}
+from build_sprite import build_sprite
+from manifest import Manifest, file_digest
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'
 
 SMALL_SIZE = (32, 32)
 LARGE_MAX = (192, 192)
 
-with open('gazette.toml', 'rb') as f:
-	content = f.read()
-	config_data = tomllib.loads(content.decode('utf-8'))
-	print(f'Found {len(config_data["feeds"]["feedlist"])} feeds in config.')
-	for feed in config_data['feeds']['feedlist']:
-		domain = feed['domain']
-		small_path = os.path.join('static', 'favicons', f'{domain}.avif')
-		large_path = os.path.join('static', 'favicons', f'{domain}-large.avif')
-		os.makedirs(os.path.dirname(small_path), exist_ok=True)
-		try:
-			response = requests.get(feed['image'], timeout=10, headers=headers)
-			response.raise_for_status()
-			raw = response.content
-			content_type = response.headers.get('Content-Type', '').lower()
-			is_svg = 'svg' in content_type or feed['image'].lower().split('?')[0].endswith('.svg')
-			if is_svg:
-				# SVG is vector — render at each target size for crisp output
-				png_small = cairosvg.svg2png(bytestring=raw, output_width=SMALL_SIZE[0], output_height=SMALL_SIZE[1])
-				Image.open(BytesIO(png_small)).save(small_path, 'AVIF')
-				png_large = cairosvg.svg2png(bytestring=raw, output_width=LARGE_MAX[0], output_height=LARGE_MAX[1])
-				Image.open(BytesIO(png_large)).save(large_path, 'AVIF')
-			else:
-				# Raster: 32×32 for posts; thumbnail preserves aspect and never upscales for sources
-				Image.open(BytesIO(raw)).resize(SMALL_SIZE).save(small_path, 'AVIF')
-				img_large = Image.open(BytesIO(raw))
-				img_large.thumbnail(LARGE_MAX, Image.Resampling.LANCZOS)
-				img_large.save(large_path, 'AVIF')
-		except Exception as e:
-			print(f'Failed to process favicon for {feed["link"]}: {e}')
-# Count all .avif images in static/favicons
-avif_count = len(
-	[
-		name
-		for name in os.listdir('static/favicons')
-		if os.path.isfile(os.path.join('static/favicons', name)) and name.endswith('.avif')
-	]
-)
-print(f'{avif_count} AVIF images in static/favicons.')
-
-# Convert navbar logo to a properly sized AVIF
-navbar_src = os.path.join('static', 'icons', 'favicon-96x96.png')
-navbar_dst = os.path.join('static', 'icons', 'favicon-96x96.avif')
-try:
-	Image.open(navbar_src).save(navbar_dst, 'AVIF')
-	print(f'Converted {navbar_src} to AVIF')
-except Exception as e:
-	print(f'Failed to convert navbar logo: {e}')
-
-for root, dirs, files in os.walk('static/img'):
-	for file in files:
-		file_path = os.path.join(root, file)
-		if file.endswith(('.png', '.webp', '.jpg', '.jpeg')):
-			# Open file and convert to AVIF
-			image_path = file_path.rsplit('.', 1)[0] + '.avif'
-			with open(file_path, 'rb') as f:
-				file_content = f.read()
-				img = Image.open(BytesIO(file_content))
-				img.thumbnail((32, 32), Image.Resampling.LANCZOS)
-				img.save(image_path, 'AVIF')
+# Downloads in flight at once, overall and per image host
+FETCH_CONCURRENCY = 16
+FETCH_PER_HOST = 2
+FETCH_TIMEOUT = 10
+
+
+def encode_favicon(raw: bytes, is_svg: bool, small_path: str, large_path: str) -> str | None:
+	"""Write both AVIF sizes of a favicon and return an error message on failure."""
+	try:
+		if is_svg:
+			# SVG is vector — render at each target size for crisp output
+			png_small = cairosvg.svg2png(
+				bytestring=raw, output_width=SMALL_SIZE[0], output_height=SMALL_SIZE[1]
+			)
+			Image.open(BytesIO(png_small)).save(small_path, 'AVIF')
+			png_large = cairosvg.svg2png(
+				bytestring=raw, output_width=LARGE_MAX[0], output_height=LARGE_MAX[1]
+			)
+			Image.open(BytesIO(png_large)).save(large_path, 'AVIF')
+		else:
+			# Raster: 32×32 for posts; thumbnail preserves aspect and never upscales for sources
+			Image.open(BytesIO(raw)).resize(SMALL_SIZE).save(small_path, 'AVIF')
+			img_large = Image.open(BytesIO(raw))
+			img_large.thumbnail(LARGE_MAX, Image.Resampling.LANCZOS)
+			img_large.save(large_path, 'AVIF')
+	except Exception as e:
+		return str(e)
+	return None
+
+
+async def update_favicon(
+	feed: dict,
+	client: httpx.AsyncClient,
+	slots: asyncio.Semaphore,
+	host_slots: dict[str, asyncio.Semaphore],
+	pool: ProcessPoolExecutor,
+	manifest: Manifest,
+) -> str:
+	"""Refresh one feed's favicon and return what happened: 'no image', 'not modified',
+	'unchanged', 'encoded' or 'failed'."""
+	domain = feed['domain']
+	url = feed.get('image')
+	if not url:
+		return 'no image'
+	small_path = os.path.join('static', 'favicons', f'{domain}.avif')
+	large_path = os.path.join('static', 'favicons', f'{domain}-large.avif')
+	outputs = [small_path, large_path]
+
+	# Validators only hold while the URL is the same and the AVIFs built from it still exist
+	previous = manifest.entries.get(domain, {})
+	cached = previous.get('url') == url and all(os.path.exists(path) for path in outputs)
+	headers = {}
+	if cached and previous.get('etag'):
+		headers['If-None-Match'] = previous['etag']
+	if cached and previous.get('modified'):
+		headers['If-Modified-Since'] = previous['modified']
+
+	try:
+		host = urlsplit(url).hostname or ''
+		# Take the host slot first so a favicon stuck behind its host doesn't hold a global slot
+		async with host_slots.setdefault(host, asyncio.Semaphore(FETCH_PER_HOST)), slots:
+			response = await client.get(url, headers=headers)
+		if cached and response.status_code == 304:
+			return 'not modified'
+		response.raise_for_status()
+	except httpx.HTTPError as e:
+		print(f'Failed to download favicon for {feed["link"]}: {e!r}')
+		return 'failed'
+
+	raw = response.content
+	digest = hashlib.sha256(raw).hexdigest()
+	validators = {
+		'url': url,
+		'etag': response.headers.get('etag'),
+		'modified': response.headers.get('last-modified'),
+	}
+	# Servers without validators, or that changed them, may still send the same bytes
+	if cached and previous.get('sha256') == digest:
+		manifest.record(domain, digest, outputs, **validators)
+		return 'unchanged'
+
+	content_type = response.headers.get('Content-Type', '').lower()
+	is_svg = 'svg' in content_type or url.lower().split('?')[0].endswith('.svg')
+	loop = asyncio.get_running_loop()
+	try:
+		error = await loop.run_in_executor(
+			pool, encode_favicon, raw, is_svg, small_path, large_path
+		)
+	except Exception as e:
+		# e.g. BrokenProcessPool if a worker crashed while encoding
+		error = repr(e)
+	if error:
+		print(f'Failed to process favicon for {feed["link"]}: {error}')
+		return 'failed'
+	manifest.record(domain, digest, outputs, **validators)
+	return 'encoded'
+
+
+async def download_favicons() -> None:
+	"""Download every feed's favicon concurrently, re-encoding only those whose bytes changed."""
+	with open('gazette.toml', 'rb') as f:
+		config_data = tomllib.loads(f.read().decode('utf-8'))
+	feeds = config_data['feeds']['feedlist']
+	print(f'Found {len(feeds)} feeds in config.')
+	os.makedirs(os.path.join('static', 'favicons'), exist_ok=True)
+
+	manifest = Manifest('favicons')
+	slots = asyncio.Semaphore(FETCH_CONCURRENCY)
+	host_slots: dict[str, asyncio.Semaphore] = {}
+	try:
+		async with httpx.AsyncClient(
+			http2=True,
+			follow_redirects=True,
+			# The semaphores queue downloads, so waiting for a pooled connection never times out
+			timeout=httpx.Timeout(FETCH_TIMEOUT, pool=None),
+			limits=httpx.Limits(
+				max_connections=FETCH_CONCURRENCY, max_keepalive_connections=FETCH_CONCURRENCY
+			),
+			headers={'User-Agent': USER_AGENT},
+		) as client:
+			with ProcessPoolExecutor() as pool:
+				outcomes = await asyncio.gather(
+					*(
+						update_favicon(feed, client, slots, host_slots, pool, manifest)
+						for feed in feeds
+					)
+				)
+	finally:
+		# Even if a feed aborted the run, keep the validators and hashes of those that finished
+		manifest.save()
+	print(', '.join(f'{outcome}: {count}' for outcome, count in sorted(Counter(outcomes).items())))
+
+
+def convert_image(src: str, dst: str, size: tuple[int, int] | None) -> str | None:
+	"""Encode src as AVIF, shrunk to fit size if given, and return an error message on failure."""
+	try:
+		with Image.open(src) as img:
+			if size:
+				img.thumbnail(size, Image.Resampling.LANCZOS)
+			img.save(dst, 'AVIF')
+	except Exception as e:
+		return str(e)
+	return None
+
+
+def convert_local_images() -> None:
+	"""Convert the navbar logo and static/img to AVIF in a process pool, skipping unchanged files."""
+	# Navbar logo at its own size, static/img as 32×32 thumbnails
+	jobs = [(os.path.join('static', 'icons', 'favicon-96x96.png'), None)]
+	for root, dirs, files in os.walk('static/img'):
+		for file in files:
+			if file.endswith(('.png', '.webp', '.jpg', '.jpeg')):
+				jobs.append((os.path.join(root, file), SMALL_SIZE))
+
+	manifest = Manifest('images')
+	pending = []
+	for src, size in jobs:
+		dst = src.rsplit('.', 1)[0] + '.avif'
+		digest = file_digest(src)
+		if not manifest.unchanged(src, digest):
+			pending.append((src, dst, size, digest))
+
+	with ProcessPoolExecutor() as pool:
+		futures = [pool.submit(convert_image, src, dst, size) for src, dst, size, _ in pending]
+		for (src, dst, size, digest), future in zip(pending, futures):
+			error = future.result()
+			if error:
+				print(f'Failed to convert {src}: {error}')
+				continue
+			manifest.record(src, digest, [dst])
+	manifest.save()
+	print(f'Converted {len(pending)} images to AVIF, {len(jobs) - len(pending)} unchanged.')
+
+
+def main() -> None:
+	asyncio.run(download_favicons())
+	# Count all .avif images in static/favicons
+	avif_count = len(
+		[
+			name
+			for name in os.listdir('static/favicons')
+			if os.path.isfile(os.path.join('static/favicons', name)) and name.endswith('.avif')
+		]
+	)
+	print(f'{avif_count} AVIF images in static/favicons.')
+	print(f'Packed {build_sprite()} favicons into the sprite.')
+	convert_local_images()
+
+
+if __name__ == '__main__':
+	main()
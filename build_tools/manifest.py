@@ -0,0 +1,46 @@
+# Content-hash manifest shared by the build tools, so unchanged inputs are skipped
+import hashlib
+import json
+import os
+
+MANIFEST_DIR = '.build-cache'
+
+
+def file_digest(path: str) -> str:
+	with open(path, 'rb') as f:
+		return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+class Manifest:
+	"""Remembers the hash of each input and the outputs built from it."""
+
+	def __init__(self, name: str):
+		self.path = os.path.join(MANIFEST_DIR, f'{name}.json')
+		try:
+			with open(self.path) as f:
+				self.entries: dict[str, dict] = json.load(f)
+		except (OSError, ValueError):
+			self.entries = {}
+
+	def unchanged(self, path: str, digest: str) -> bool:
+		"""True if path had this hash at the last build and all its outputs still exist."""
+		entry = self.entries.get(path)
+		return (
+			entry is not None
+			and entry['sha256'] == digest
+			and all(os.path.exists(output) for output in entry['outputs'])
+		)
+
+	def stale(self, path: str, digest: str) -> bool:
+		"""True if path was recorded with a different hash, i.e. its outputs are outdated."""
+		entry = self.entries.get(path)
+		return entry is not None and entry['sha256'] != digest
+
+	def record(self, path: str, digest: str, outputs: list[str], **extra) -> None:
+		"""Remember path's hash and outputs, plus any extra metadata such as HTTP validators."""
+		self.entries[path] = {'sha256': digest, 'outputs': outputs, **extra}
+
+	def save(self) -> None:
+		os.makedirs(MANIFEST_DIR, exist_ok=True)
+		with open(self.path, 'w') as f:
+			json.dump(self.entries, f, indent=1, sort_keys=True)
@@ -0,0 +1,121 @@
+# Collapses whitespace in the page templates once at build time, so the
+# renderer produces compact HTML without minifying every generated page.
+import base64
+import hashlib
+import os
+import re
+import sys
+from datetime import datetime
+
+from jinja2 import Environment, FileSystemLoader
+
+TEMPLATES_DIR = 'templates'
+MINIFIED_SUFFIXES = ('.html', '.xml', '.opml')
+# Already compressed by compress_all.py, and hashed into the CSP: never touch it
+SKIPPED_TEMPLATES = ('inline_style.html',)
+
+_WHITESPACE = re.compile(r'\s+')
+_STYLE = re.compile(r'<style>(.*?)</style>', re.DOTALL)
+
+
+def create_environment(templates_dir: str) -> Environment:
+	# Same whitespace control as the runtime environment in utils/templates.py
+	return Environment(
+		loader=FileSystemLoader(templates_dir),
+		trim_blocks=True,
+		lstrip_blocks=True,
+	)
+
+
+def minify_template(source: str) -> str:
+	"""Collapse every whitespace run to a single space.
+
+	Browsers already render any run of whitespace as one space, and the templates
+	have no <pre> or <textarea>, so this only changes the bytes, not the page.
+	"""
+	return _WHITESPACE.sub(' ', source).strip()
+
+
+def minify_templates(templates_dir: str = TEMPLATES_DIR) -> int:
+	"""Minify the templates in templates_dir in place and return how many were changed."""
+	changed = 0
+	for name in sorted(os.listdir(templates_dir)):
+		if not name.endswith(MINIFIED_SUFFIXES) or name in SKIPPED_TEMPLATES:
+			continue
+		path = os.path.join(templates_dir, name)
+		with open(path, encoding='utf-8') as f:
+			source = f.read()
+		minified = minify_template(source)
+		if minified != source:
+			with open(path, 'w', encoding='utf-8') as f:
+				f.write(minified)
+			changed += 1
+	return changed
+
+
+def render_fragments(env: Environment, count: int) -> list[str]:
+	"""Render count sample post cards."""
+	return [
+		env.get_template('post.html').render(
+			article={
+				'link': f'https://example.com/article-{i}',
+				'title': f'Article {i}',
+				'publication_date': datetime(2025, 1, 1, 12, 0),
+				'feed_link': 'https://example.com/feed.xml',
+				'feed_title': 'Example',
+				'feed_subtitle': 'Un exemple',
+				'feed_domain': 'example.com',
+				'feed_image': 'https://example.com/icon.png' if i % 2 else '',
+			}
+		)
+		for i in range(count)
+	]
+
+
+def render_page(env: Environment, csp_hash: str, fragments: list[str]) -> str:
+	"""Render the home page from post cards the way utils/utils.py does."""
+	half = len(fragments) // 2
+	return env.get_template('index.html').render(
+		posts_today=fragments[half:],
+		posts_yesterday=fragments[:half],
+		plus=True,
+		css_hash='',
+		js_hash='',
+		canonical_url='https://insoumis.news/',
+		csp_hash=csp_hash,
+		is_home=True,
+	)
+
+
+def render_sample(env: Environment, csp_hash: str) -> str:
+	return render_page(env, csp_hash, render_fragments(env, 2))
+
+
+def minify_and_check(templates_dir: str = TEMPLATES_DIR) -> int:
+	"""Minify the templates, then check the home page against the unminified render.
+
+	The page must be the same up to whitespace, and its inline style must still hash
+	to static/csp-hash.txt, or browsers would refuse to apply it.
+	"""
+	with open('static/csp-hash.txt') as csp_file:
+		csp_hash = csp_file.read().strip()
+
+	reference = render_sample(Environment(loader=FileSystemLoader(templates_dir)), csp_hash)
+	changed = minify_templates(templates_dir)
+	html = render_sample(create_environment(templates_dir), csp_hash)
+
+	if _WHITESPACE.sub(' ', html) != _WHITESPACE.sub(' ', reference):
+		sys.exit('Minified templates render a different home page')
+
+	styles = _STYLE.findall(html)
+	if len(styles) != 1:
+		sys.exit(f'Expected one inline <style> in index.html, found {len(styles)}')
+	digest = base64.b64encode(hashlib.sha256(styles[0].encode()).digest()).decode()
+	if f'sha256-{digest}' != csp_hash:
+		sys.exit(f'Inline style hashes to sha256-{digest}, but the CSP allows {csp_hash}')
+
+	return changed
+
+
+if __name__ == '__main__':
+	print(f'Minified {minify_and_check()} templates.')
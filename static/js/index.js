@@ -60,3 +60,24 @@ if (!isPWA) {
     if (installButton) installButton.removeAttribute("hidden");
   });
 }
+
+// Relative publication times are formatted here rather than at render time,
+// so the server can reuse post cards between builds and labels stay current.
+function timeAgo(date) {
+  const seconds = Math.floor((Date.now() - date) / 1000);
+  if (seconds < 60) return "À l'instant";
+  const minutes = Math.floor(seconds / 60);
+  if (minutes < 60) return "Il y a " + minutes + " min";
+  const hours = Math.floor(minutes / 60);
+  if (hours < 24) return "Il y a " + hours + "h";
+  return "Il y a " + Math.floor(hours / 24) + "j";
+}
+
+function updateTimes() {
+  for (const time of document.querySelectorAll("time[datetime]")) {
+    time.textContent = timeAgo(new Date(time.dateTime));
+  }
+}
+
+updateTimes();
+setInterval(updateTimes, 60000);
@@ -1,4 +1,7 @@
 const isPWA=!!(window.matchMedia?.("(display-mode: standalone)").matches||window.matchMedia?.("(display-mode: fullscreen)").matches||window.navigator.standalone);const manifestLink=document.createElement("link");manifestLink.rel="manifest";manifestLink.href="/manifest.json";document.head.appendChild(manifestLink);if("serviceWorker"in navigator){navigator.serviceWorker.register("/sw.js").then((registration)=>{console.log("Service Worker registered with scope:",registration.scope);}).catch((error)=>{console.error("Service Worker registration failed:",error);});}
 const offlineBanner=document.querySelector("#offline-banner");function updateOfflineStatus(){if(offlineBanner){if(navigator.onLine){offlineBanner.classList.add("hidden");}else{offlineBanner.classList.remove("hidden");}}}
 window.addEventListener("online",updateOfflineStatus);window.addEventListener("offline",updateOfflineStatus);updateOfflineStatus();if(!isPWA){let installPrompt=null;const installButton=document.querySelector("#install-button");if(installButton){installButton.addEventListener("click",async()=>{if(!installPrompt)return;const result=await installPrompt.prompt();console.log(`Install prompt was:${result.outcome}`);installPrompt=null;installButton.setAttribute("hidden","");});}
-window.addEventListener("beforeinstallprompt",(e)=>{e.preventDefault();installPrompt=e;if(installButton)installButton.removeAttribute("hidden");});}
\ No newline at end of file
+window.addEventListener("beforeinstallprompt",(e)=>{e.preventDefault();installPrompt=e;if(installButton)installButton.removeAttribute("hidden");});}
+function timeAgo(date){const seconds=Math.floor((Date.now()-date)/1000);if(seconds<60)return"À l'instant";const minutes=Math.floor(seconds/60);if(minutes<60)return"Il y a "+minutes+" min";const hours=Math.floor(minutes/60);if(hours<24)return"Il y a "+hours+"h";return"Il y a "+Math.floor(hours/24)+"j";}
+function updateTimes(){for(const time of document.querySelectorAll("time[datetime]")){time.textContent=timeAgo(new Date(time.dateTime));}}
+updateTimes();setInterval(updateTimes,60000);
\ No newline at end of file
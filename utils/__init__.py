@@ -1,18 +1,52 @@
 import os
 
+from sqlalchemy import event
 from sqlalchemy.pool import StaticPool
 from sqlmodel import create_engine
 
-engine = create_engine(
-	'sqlite:///:memory:',
-	echo=False,
-	connect_args={'check_same_thread': False},
-	poolclass=StaticPool,
-)
+# Optional on-disk store; posts, validators and failure counters then survive restarts
+DATABASE_PATH = os.getenv('DATABASE_PATH', '')
+
+# Applied to every on-disk connection: WAL lets the renderer read while a feed writes
+SQLITE_PRAGMAS = {
+	'journal_mode': 'WAL',
+	'synchronous': 'NORMAL',
+	'temp_store': 'MEMORY',
+	'mmap_size': 256 * 1024 * 1024,
+	'cache_size': -16 * 1024,  # negative = KiB
+	'busy_timeout': 30_000,
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+	cursor = dbapi_connection.cursor()
+	for name, value in SQLITE_PRAGMAS.items():
+		cursor.execute(f'PRAGMA {name} = {value}')
+	cursor.close()
+
+
+if DATABASE_PATH:
+	os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
+	engine = create_engine(
+		f'sqlite:///{DATABASE_PATH}',
+		echo=False,
+		connect_args={'check_same_thread': False},
+	)
+	event.listen(engine, 'connect', _set_sqlite_pragmas)
+else:
+	engine = create_engine(
+		'sqlite:///:memory:',
+		echo=False,
+		connect_args={'check_same_thread': False},
+		poolclass=StaticPool,
+	)
 
 # Paths for static files
 STATIC_DIR = 'static'
 os.makedirs(STATIC_DIR, exist_ok=True)
 HTML_FILE = os.path.join(STATIC_DIR, 'index.html')
 RSS_FILE = os.path.join(STATIC_DIR, 'feed.xml')
+# Monitoring files rewritten after every refresh cycle
+STATUS_FILE = os.path.join(STATIC_DIR, 'status.json')
+METRICS_FILE = os.path.join(STATIC_DIR, 'metrics.txt')
 TEMPLATES_DIR = 'templates'
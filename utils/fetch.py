@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+
+FEED_TIMEOUT = 30
+
+# Shorter timeout for half-open circuit breaker probes
+PROBE_TIMEOUT = 10
+
+# Fetches in flight at once, overall and per feed domain. The FEED_TIMEOUT clock
+# only starts once a fetch holds both slots, so queueing never counts as a timeout.
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', '10'))
+FETCH_PER_HOST = int(os.getenv('FETCH_PER_HOST', '2'))
+KEEPALIVE_EXPIRY = 120
+
+USER_AGENT = 'Mozilla/5.0 (compatible; Gazette/1.0; +https://insoumis.news)'
+
+_client: httpx.AsyncClient | None = None
+_global_slots: asyncio.Semaphore | None = None
+_host_slots: dict[str, asyncio.Semaphore] = {}
+
+
+@dataclass
+class FetchResult:
+	"""Raw feed response, ready to be handed to feedparser."""
+
+	status: int
+	url: str
+	content: bytes = b''
+	etag: str | None = None
+	modified: str | None = None
+	headers: dict[str, str] | None = None
+	# Cache lifetime announced by the server, in seconds
+	max_age: int | None = None
+	# Download time, excluding the wait for a fetch slot
+	elapsed: float = 0.0
+
+	@property
+	def not_modified(self) -> bool:
+		return self.status == 304
+
+
+def get_client() -> httpx.AsyncClient:
+	"""Return the process-wide HTTP client, creating it on first use."""
+	global _client
+	if _client is None or _client.is_closed:
+		_client = httpx.AsyncClient(
+			http2=True,
+			follow_redirects=True,
+			timeout=httpx.Timeout(FEED_TIMEOUT),
+			limits=httpx.Limits(
+				max_connections=FETCH_CONCURRENCY,
+				max_keepalive_connections=FETCH_CONCURRENCY,
+				keepalive_expiry=KEEPALIVE_EXPIRY,
+			),
+			headers={
+				'User-Agent': USER_AGENT,
+				'Accept': 'application/rss+xml, application/atom+xml, application/xml;q=0.9, */*;q=0.8',
+				'Accept-Encoding': 'br, gzip, deflate',
+			},
+		)
+	return _client
+
+
+async def close_client() -> None:
+	global _client
+	if _client is not None:
+		await _client.aclose()
+		_client = None
+
+
+def _cache_lifetime(headers: httpx.Headers) -> int | None:
+	"""Return how long the response may be cached, from Cache-Control or Expires."""
+	for directive in headers.get('cache-control', '').split(','):
+		name, _, value = directive.strip().partition('=')
+		value = value.strip('"')
+		if name.lower() == 'max-age' and value.isdigit():
+			return int(value)
+
+	if 'expires' in headers:
+		try:
+			expires = parsedate_to_datetime(headers['expires'])
+		except (TypeError, ValueError):
+			return None
+		if expires.tzinfo is None:
+			expires = expires.replace(tzinfo=UTC)
+		return max(int((expires - datetime.now(UTC)).total_seconds()), 0)
+
+	return None
+
+
+def _global_slot() -> asyncio.Semaphore:
+	global _global_slots
+	if _global_slots is None:
+		_global_slots = asyncio.Semaphore(FETCH_CONCURRENCY)
+	return _global_slots
+
+
+def _host_slot(host: str) -> asyncio.Semaphore:
+	if host not in _host_slots:
+		_host_slots[host] = asyncio.Semaphore(FETCH_PER_HOST)
+	return _host_slots[host]
+
+
+async def fetch_feed(
+	url: str,
+	etag: str | None = None,
+	modified: str | None = None,
+	domain: str | None = None,
+	timeout: float | None = None,
+) -> FetchResult:
+	"""Download a feed, sending conditional headers when validators are known.
+
+	Waiting fetches are served in call order, so callers start the most important
+	feeds first. domain groups feeds sharing a host; it defaults to the URL's host.
+
+	Raises httpx.HTTPStatusError on 4xx/5xx responses and asyncio.TimeoutError
+	if the whole request takes longer than timeout (FEED_TIMEOUT by default).
+	"""
+	headers = {}
+	if etag:
+		headers['If-None-Match'] = etag
+	if modified:
+		headers['If-Modified-Since'] = modified
+
+	# Take the host slot first so a feed stuck behind its host doesn't hold a global slot
+	async with _host_slot(domain or urlsplit(url).hostname or ''), _global_slot():
+		start = time.perf_counter()
+		response = await asyncio.wait_for(
+			get_client().get(url, headers=headers),
+			timeout=timeout or FEED_TIMEOUT,
+		)
+		elapsed = time.perf_counter() - start
+
+	if response.status_code == 304:
+		return FetchResult(
+			status=304,
+			url=str(response.url),
+			etag=etag,
+			modified=modified,
+			max_age=_cache_lifetime(response.headers),
+			elapsed=elapsed,
+		)
+	response.raise_for_status()
+
+	# Only pass feedparser the headers it uses for encoding detection and relative links;
+	# the body has already been decompressed by httpx.
+	parse_headers = {'content-location': str(response.url)}
+	for name in ('content-type', 'content-language'):
+		if name in response.headers:
+			parse_headers[name] = response.headers[name]
+
+	return FetchResult(
+		status=response.status_code,
+		url=str(response.url),
+		content=response.content,
+		etag=response.headers.get('etag'),
+		modified=response.headers.get('last-modified'),
+		headers=parse_headers,
+		max_age=_cache_lifetime(response.headers),
+		elapsed=elapsed,
+	)
@@ -4,19 +4,42 @@ import os
 import structlog
 
 LOGLEVEL = os.getenv('LOGLEVEL', 'INFO').upper()
+# 'console' for coloured, human-readable lines, 'json' for one JSON object per line
+LOGFORMAT = os.getenv('LOGFORMAT', 'console').lower()
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+def _orjson_dumps(event_dict: dict, **kwargs) -> str:
+	return orjson.dumps(event_dict, default=kwargs.get('default')).decode()
+
+
+def _renderer():
+	if LOGFORMAT == 'json':
+		if orjson is not None:
+			return structlog.processors.JSONRenderer(serializer=_orjson_dumps)
+		return structlog.processors.JSONRenderer()
+	return structlog.dev.ConsoleRenderer(colors=True)  # Pretty, human-readable logs
 
 
 def configure_logging():
-	# Define a shared processor chain for structlog
-	processors = [
+	# Shared by structlog events and records from standard logging (APScheduler, SQLAlchemy)
+	shared_processors = [
+		structlog.stdlib.add_log_level,  # Include log level in logs
 		structlog.stdlib.PositionalArgumentsFormatter(),  # Format positional args
 		structlog.processors.StackInfoRenderer(),  # Add stack info if available
-		structlog.dev.ConsoleRenderer(colors=True),  # Pretty, human-readable logs
+		structlog.processors.TimeStamper(fmt='iso', utc=LOGFORMAT == 'json'),  # ISO 8601
 	]
+	if LOGFORMAT == 'json':
+		# Tracebacks as a string field instead of a multi-line dump
+		shared_processors.append(structlog.processors.format_exc_info)
 
-	# Configure structlog
+	# Configure structlog: events are rendered once, by the handler's formatter below
 	structlog.configure(
-		processors=processors,
+		processors=shared_processors + [structlog.stdlib.ProcessorFormatter.wrap_for_formatter],
 		wrapper_class=structlog.make_filtering_bound_logger(LOGLEVEL),
 		context_class=dict,
 		logger_factory=structlog.stdlib.LoggerFactory(),
@@ -25,13 +48,8 @@ def configure_logging():
 
 	# Redirect standard logging to structlog
 	formatter = structlog.stdlib.ProcessorFormatter(
-		processor=structlog.dev.ConsoleRenderer(colors=True),  # Pretty logs
-		foreign_pre_chain=[
-			structlog.stdlib.add_log_level,  # Include log level in logs
-			structlog.stdlib.PositionalArgumentsFormatter(),  # Format positional args
-			structlog.processors.StackInfoRenderer(),  # Add stack info if available
-			structlog.processors.TimeStamper(fmt='iso', utc=False),  # Add ISO 8601 timestamps
-		],
+		processors=[structlog.stdlib.ProcessorFormatter.remove_processors_meta, _renderer()],
+		foreign_pre_chain=shared_processors,
 	)
 
 	# Set up the root logger
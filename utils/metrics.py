@@ -0,0 +1,132 @@
+import bisect
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict[str, str]) -> LabelKey:
+	return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+	pairs = key + extra
+	if not pairs:
+		return ''
+	return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Metric(ABC):
+	kind = ''
+
+	def __init__(self, name: str, description: str):
+		self.name = name
+		self.description = description
+		REGISTRY.append(self)
+
+	@abstractmethod
+	def samples(self) -> list[str]: ...
+
+	def render(self) -> str:
+		lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+		return '\n'.join(lines + self.samples())
+
+
+class Counter(Metric):
+	kind = 'counter'
+
+	def __init__(self, name: str, description: str):
+		super().__init__(name, description)
+		self.values: dict[LabelKey, float] = {}
+
+	def inc(self, amount: float = 1, **labels: str) -> None:
+		key = _label_key(labels)
+		self.values[key] = self.values.get(key, 0) + amount
+
+	def samples(self) -> list[str]:
+		return [f'{self.name}{_format_labels(key)} {value}' for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+	kind = 'gauge'
+
+	def set(self, value: float, **labels: str) -> None:
+		self.values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+	kind = 'histogram'
+
+	def __init__(self, name: str, description: str):
+		super().__init__(name, description)
+		# Per label set: count per bucket (the last one is +Inf), sum of observations
+		self.buckets: dict[LabelKey, list[int]] = {}
+		self.sums: dict[LabelKey, float] = {}
+
+	def observe(self, value: float, **labels: str) -> None:
+		key = _label_key(labels)
+		if key not in self.buckets:
+			self.buckets[key] = [0] * (len(BUCKETS) + 1)
+			self.sums[key] = 0.0
+		self.buckets[key][bisect.bisect_left(BUCKETS, value)] += 1
+		self.sums[key] += value
+
+	@contextmanager
+	def time(self, **labels: str):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - start, **labels)
+
+	def summary(self, **labels: str) -> dict[str, float]:
+		key = _label_key(labels)
+		count = sum(self.buckets.get(key, ()))
+		return {'count': count, 'sum': round(self.sums.get(key, 0.0), 3)}
+
+	def samples(self) -> list[str]:
+		lines = []
+		for key, counts in self.buckets.items():
+			cumulative = 0
+			for bound, count in zip((*BUCKETS, '+Inf'), counts):
+				cumulative += count
+				lines.append(
+					f'{self.name}_bucket{_format_labels(key, (("le", str(bound)),))} {cumulative}'
+				)
+			lines.append(f'{self.name}_sum{_format_labels(key)} {self.sums[key]}')
+			lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+		return lines
+
+
+REGISTRY: list[Metric] = []
+
+FETCH_SECONDS = Histogram('gazette_fetch_seconds', 'Feed download time, once a fetch slot is held')
+FETCHES = Counter('gazette_fetches_total', 'Feed fetches by outcome')
+PARSE_SECONDS = Histogram('gazette_parse_seconds', 'Feed parsing time, including executor queueing')
+DB_SECONDS = Histogram('gazette_db_seconds', "Time spent storing a feed's posts and state")
+POSTS_WRITTEN = Counter('gazette_posts_written_total', 'Posts inserted or updated')
+POSTS_DELETED = Counter('gazette_posts_deleted_total', 'Posts removed by the retention cleanup')
+CLEANUP_SECONDS = Histogram('gazette_cleanup_seconds', 'Retention cleanup time')
+RENDER_SECONDS = Histogram('gazette_render_seconds', 'Static page generation time')
+CYCLE_SECONDS = Histogram('gazette_cycle_seconds', 'Refresh cycle duration')
+FEEDS = Gauge('gazette_feeds', 'Feeds by circuit breaker state')
+FEEDS_FAILING = Gauge('gazette_feeds_failing', 'Feeds whose last fetch failed')
+POSTS = Gauge('gazette_posts', 'Posts currently stored')
+LAST_CYCLE = Gauge('gazette_last_cycle_timestamp_seconds', 'End of the last refresh cycle')
+
+# Duration of each feed's last completed download, keyed by feed link
+feed_fetch_seconds: dict[str, float] = {}
+
+
+def record_fetch(link: str, seconds: float) -> None:
+	FETCH_SECONDS.observe(seconds)
+	feed_fetch_seconds[link] = seconds
+
+
+def render_prometheus() -> str:
+	"""Render every metric in the Prometheus text exposition format."""
+	return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
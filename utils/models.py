@@ -1,21 +1,60 @@
 import asyncio
-from datetime import datetime
-from time import mktime
-
-import feedparser
-from sqlalchemy import Index
-from sqlmodel import Field, Relationship, Session, SQLModel
-
-from utils import engine
+import calendar
+import hashlib
+from collections import Counter
+from datetime import datetime, timedelta
+from enum import StrEnum
+from time import mktime, perf_counter
+
+import httpx
+from sqlalchemy import JSON, Column, Index, func, or_
+from sqlalchemy import select as sa_select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Field, Relationship, Session, SQLModel, delete, select
+
+from utils import engine, metrics, profiling, schedule
+from utils.fetch import PROBE_TIMEOUT, fetch_feed
 from utils.logs import logger
+from utils.parse import ParsedEntry, ParsedFeed, parse
+
 
-FEED_TIMEOUT = 30
+class BreakerState(StrEnum):
+	CLOSED = 'closed'  # fetched on its regular interval
+	OPEN = 'open'  # failing, left alone until its backoff expires
+	HALF_OPEN = 'half_open'  # backoff expired, next fetch is a probe
 
 
 class FeedParsingError(Exception):
 	"""Raised when a feed is too malformed to parse."""
 
 
+# Posts older than this are deleted, and never ingested in the first place
+RETENTION = timedelta(weeks=1)
+
+
+def _entry_key(entry: ParsedEntry) -> str:
+	"""Identify an entry revision: its guid (or link) plus its updated timestamp."""
+	updated = calendar.timegm(entry.updated_parsed) if entry.updated_parsed else ''
+	return f'{entry.id or entry.link}@{updated}'
+
+
+def _entries_hash(entries: list[ParsedEntry]) -> str:
+	"""Return an order-independent fingerprint of a feed's entries."""
+	keys = sorted(
+		repr(
+			(
+				entry.link,
+				entry.title,
+				tuple(entry.published_parsed or ()),
+				tuple(entry.updated_parsed or ()),
+				entry.accesspermission,
+			)
+		)
+		for entry in entries
+	)
+	return hashlib.sha256('\n'.join(keys).encode()).hexdigest()
+
+
 class Feed(SQLModel, table=True):
 	link: str = Field(primary_key=True)
 	domain: str
@@ -34,164 +73,189 @@ class Feed(SQLModel, table=True):
 	etag: str | None = Field(default=None)
 	modified: str | None = Field(default=None)
 
+	# Fingerprint of the last ingested entry set, see _entries_hash
+	content_hash: str | None = Field(default=None)
+
+	# Entry revisions already ingested, see _entry_key; only those still in the feed are kept
+	seen_entries: list[str] = Field(default_factory=list, sa_column=Column(JSON))
+
+	# Adaptive refresh, see utils/schedule.py (intervals in seconds)
+	publication_interval: float | None = Field(default=None)
+	server_interval: int | None = Field(default=None)
+	unchanged_ratio: float = Field(default=0.0)
+	refresh_interval: int | None = Field(default=None)
+	next_fetch: datetime | None = Field(default=None)
+
 	# Failure tracking
 	failure_count: int = Field(default=0)
 	last_error: str | None = Field(default=None)
 	last_success: datetime | None = Field(default=None)
+	breaker_state: BreakerState = Field(default=BreakerState.CLOSED)
 
 	@classmethod
-	async def init_feed(cls, feed_dict: dict):
-		logger.info('Initializing feed', feed=feed_dict['link'])
-		error_msg = None
-
-		try:
-			data: dict = await asyncio.wait_for(
-				asyncio.to_thread(feedparser.parse, feed_dict['link']),
-				timeout=FEED_TIMEOUT,
-			)
-
-			if data.bozo:
-				bozo_msg = getattr(
-					data.bozo_exception, 'getMessage', lambda: str(data.bozo_exception)
-				)()
-				logger.warning('Feed has formatting issues', feed=feed_dict['link'], issue=bozo_msg)
-				if not hasattr(data, 'feed') or not data.entries:
-					raise FeedParsingError(f'Feed too malformed to parse: {bozo_msg}')
-
-			feed = Feed(
-				link=getattr(data.feed, 'link', feed_dict['link']),
-				domain=getattr(data.feed, 'link', feed_dict['link'])
-				.split('/')[2]
-				.removeprefix('www.'),
-				title=getattr(data.feed, 'title', feed_dict.get('title', 'Unknown')),
-				subtitle=getattr(data.feed, 'subtitle', ''),
-				image=getattr(getattr(data.feed, 'image', None), 'href', None),
-				last_success=datetime.now(),
-				failure_count=0,
-			)
-
-			# Override with config values if provided
-			for key, value in feed_dict.items():
-				if hasattr(feed, key):
-					setattr(feed, key, value)
-
-			with Session(engine) as session:
-				session.merge(feed)
-				session.commit()
-
-			logger.info('Successfully initialized feed', feed=feed_dict['link'])
-			return feed
-
-		except (AttributeError, KeyError) as e:
-			error_msg = f'Invalid feed structure: {e}'
-			logger.error('Invalid feed structure', feed=feed_dict['link'], error=str(e))
-		except (ConnectionError, ConnectionResetError, TimeoutError, asyncio.TimeoutError) as e:
-			error_msg = f'Connection error: {e}'
-			logger.error('Connection failed', feed=feed_dict['link'], error=str(e))
-		except FeedParsingError as e:
-			error_msg = f'Malformed feed: {e}'
-			logger.error('Malformed feed', feed=feed_dict['link'], error=str(e))
-		except Exception as e:
-			error_msg = f'Unexpected error: {e}'
-			logger.error('Unexpected error initializing feed', feed=feed_dict['link'], error=str(e))
-
-		# Save failed feed with error information
-		if error_msg:
-			try:
-				with Session(engine) as session:
-					failed_feed = Feed(
-						link=feed_dict['link'],
-						domain=feed_dict['link'].split('/')[2].removeprefix('www.'),
-						title=feed_dict.get('title', 'Unknown'),
-						subtitle=feed_dict.get('subtitle', ''),
-						image=feed_dict.get('image', ''),
-						failure_count=1,
-						last_error=error_msg[:500],
-					)
-					session.merge(failed_feed)
-					session.commit()
-			except Exception as db_error:
-				logger.error(
-					'Failed to save error state', feed=feed_dict['link'], error=str(db_error)
-				)
-
-		return None
+	def from_config(cls, feed_dict: dict) -> 'Feed':
+		"""Build a feed from its gazette.toml entry without any network I/O.
+
+		Metadata missing from the config is filled in by the first successful fetch.
+		"""
+		domain = feed_dict['link'].split('/')[2].removeprefix('www.')
+		feed = Feed(link=feed_dict['link'], domain=domain, title=domain)
+		feed.apply_config(feed_dict)
+		return feed
+
+	def apply_config(self, feed_dict: dict) -> None:
+		"""Override fields with the values set in gazette.toml."""
+		for key, value in feed_dict.items():
+			if hasattr(self, key):
+				setattr(self, key, value)
+
+	def fill_metadata(self, data: ParsedFeed) -> None:
+		"""Complete the metadata gazette.toml didn't provide from the fetched feed."""
+		if self.title == self.domain and data.title:
+			self.title = data.title
+		if not self.subtitle and data.subtitle:
+			self.subtitle = data.subtitle
+		if not self.image and data.image:
+			self.image = data.image
+
+	def reschedule(self, unchanged: bool | None) -> None:
+		"""Pick the next fetch time from this feed's observed behaviour.
+
+		unchanged is None after a failed fetch, which says nothing about the feed's pace.
+		"""
+		if unchanged is not None:
+			self.unchanged_ratio = schedule.update_unchanged_ratio(self.unchanged_ratio, unchanged)
+		self.refresh_interval = schedule.refresh_interval(
+			self.publication_interval, self.unchanged_ratio, self.server_interval
+		)
+		self.next_fetch = schedule.next_fetch_at(self.refresh_interval)
+
+	def record_success(self) -> None:
+		if self.breaker_state != BreakerState.CLOSED:
+			logger.info('Feed recovered, closing circuit breaker', feed=self.link)
+		self.last_success = datetime.now()
+		self.failure_count = 0
+		self.last_error = None
+		self.breaker_state = BreakerState.CLOSED
+
+	def record_failure(self, error_msg: str) -> None:
+		"""Count a failed fetch, opening the circuit breaker after repeated failures."""
+		self.failure_count += 1
+		self.last_error = error_msg[:500]
+		if self.failure_count < schedule.BREAKER_THRESHOLD:
+			self.reschedule(unchanged=None)
+			return
+
+		self.breaker_state = BreakerState.OPEN
+		self.next_fetch = datetime.now() + timedelta(
+			seconds=schedule.failure_backoff(self.failure_count)
+		)
+		logger.warning(
+			'Circuit breaker open, backing off',
+			feed=self.link,
+			failure_count=self.failure_count,
+			retry_at=self.next_fetch.isoformat(timespec='seconds'),
+		)
 
 	async def update_posts(self) -> bool:
 		"""Update posts for this feed. Returns True if new content was added."""
 		error_msg = None
-		posts_added = 0
+		rows: list[dict] = []
 
 		try:
-			data: dict = await asyncio.wait_for(
-				asyncio.to_thread(
-					feedparser.parse, self.link, etag=self.etag, modified=self.modified
-				),
-				timeout=FEED_TIMEOUT,
-			)
+			with profiling.span('fetch'):
+				result = await fetch_feed(
+					self.link,
+					etag=self.etag,
+					modified=self.modified,
+					domain=self.domain,
+					# A probe of a failing feed shouldn't hold up the cycle for the full timeout
+					timeout=PROBE_TIMEOUT if self.breaker_state == BreakerState.HALF_OPEN else None,
+				)
+
+			metrics.record_fetch(self.link, result.elapsed)
 
 			# Handle 304 Not Modified
-			if hasattr(data, 'status') and data.status == 304:
+			if result.not_modified:
+				metrics.FETCHES.inc(outcome='not_modified')
 				logger.debug('Feed not modified, skipping', feed=self.title)
+				with Session(engine) as session:
+					feed = session.get(Feed, self.link)
+					if feed:
+						feed.record_success()
+						if result.max_age:
+							feed.server_interval = max(result.max_age, feed.server_interval or 0)
+						feed.reschedule(unchanged=True)
+						session.commit()
 				return False
 
+			with metrics.PARSE_SECONDS.time(), profiling.span('parse'):
+				data = await parse(result.content, result.headers)
+
 			if data.bozo:
-				bozo_msg = getattr(
-					data.bozo_exception, 'getMessage', lambda: str(data.bozo_exception)
-				)()
-				logger.warning('Feed has formatting issues', feed=self.link, issue=bozo_msg)
+				logger.warning(
+					'Feed has formatting issues', feed=self.link, issue=data.bozo_message
+				)
 				if not data.entries:
 					raise FeedParsingError('Feed returned no entries due to parsing errors')
 
+			# Skip entry processing entirely when the feed's entry set hasn't changed,
+			# and otherwise skip the entries already ingested by an earlier run
+			content_hash = _entries_hash(data.entries)
+			entry_keys = [_entry_key(entry) for entry in data.entries]
+			if content_hash == self.content_hash:
+				entries = []
+				logger.debug('Feed entries unchanged, skipping', feed=self.title)
+			else:
+				seen = set(self.seen_entries or ())
+				entries = [
+					entry
+					for entry, key in zip(data.entries, entry_keys, strict=True)
+					if key not in seen
+				]
+			cutoff = datetime.now() - RETENTION
+			# Problems with single entries, logged once per feed rather than once per entry
+			entry_issues: Counter[str] = Counter()
+
 			with Session(engine) as session:
-				for entry in data.entries:
+				for entry in entries:
 					try:
-						if not hasattr(entry, 'link') or not hasattr(entry, 'title'):
-							logger.warning(
-								'Entry missing required fields, skipping', feed=self.title
-							)
+						if not entry.link or not entry.title:
+							entry_issues['missing_fields'] += 1
 							continue
 
-						if self.free_only and entry.get('accesspermission', 'free') != 'free':
+						if self.free_only and entry.accesspermission != 'free':
 							continue
 
 						# Get publication date with fallback chain
 						pub_date = None
-						if hasattr(entry, 'published_parsed') and entry.published_parsed:
+						if entry.published_parsed:
 							try:
 								pub_date = datetime.fromtimestamp(mktime(entry.published_parsed))
-							except (ValueError, OverflowError, OSError) as e:
-								logger.warning(
-									'Invalid published_parsed date', feed=self.title, error=str(e)
-								)
-
-						if (
-							not pub_date
-							and hasattr(entry, 'updated_parsed')
-							and entry.updated_parsed
-						):
+							except (ValueError, OverflowError, OSError):
+								entry_issues['invalid_published'] += 1
+
+						if not pub_date and entry.updated_parsed:
 							try:
 								pub_date = datetime.fromtimestamp(mktime(entry.updated_parsed))
-							except (ValueError, OverflowError, OSError) as e:
-								logger.warning(
-									'Invalid updated_parsed date', feed=self.title, error=str(e)
-								)
+							except (ValueError, OverflowError, OSError):
+								entry_issues['invalid_updated'] += 1
 
 						if not pub_date:
 							pub_date = datetime.now()
-							logger.warning(
-								'Entry has no valid date, using current time', feed=self.title
-							)
-
-						parsed_entry = Post(
-							link=entry.link,
-							title=entry.title,
-							feed_link=self.link,
-							publication_date=pub_date,
-						)
+							entry_issues['undated'] += 1
 
-						session.merge(parsed_entry)
-						posts_added += 1
+						if pub_date < cutoff:
+							continue
+
+						rows.append(
+							{
+								'link': entry.link,
+								'title': entry.title,
+								'feed_link': self.link,
+								'publication_date': pub_date,
+							}
+						)
 
 					except AttributeError as ae:
 						logger.error('Invalid entry structure', feed=self.title, error=str(ae))
@@ -200,27 +264,57 @@ class Feed(SQLModel, table=True):
 						logger.error('Error processing entry', feed=self.title, error=str(e))
 						continue
 
+				if entry_issues:
+					logger.warning('Entries skipped or undated', feed=self.title, **entry_issues)
+
+				db_start = perf_counter()
+				with profiling.span('upsert', rows=len(rows)):
+					posts_added, posts_updated = Post.upsert_many(session, rows)
+
 				# Single transaction: commit posts + update feed metadata
 				feed = session.get(Feed, self.link)
 				if feed:
-					feed.last_success = datetime.now()
-					feed.failure_count = 0
-					feed.last_error = None
-					feed.etag = getattr(data, 'etag', None)
-					feed.modified = getattr(data, 'modified', None)
+					feed.fill_metadata(data)
+					feed.record_success()
+					feed.etag = result.etag
+					feed.modified = result.modified
+					feed.content_hash = content_hash
+					feed.seen_entries = entry_keys
+					feed.publication_interval = data.publication_interval
+					feed.server_interval = max(result.max_age or 0, data.ttl or 0) or None
+					feed.reschedule(unchanged=posts_added + posts_updated == 0)
 
 				try:
 					session.commit()
-					logger.info('Updated posts', feed=self.title, count=posts_added)
-					return posts_added > 0
+					metrics.DB_SECONDS.observe(perf_counter() - db_start)
+					metrics.FETCHES.inc(outcome='modified')
+					metrics.POSTS_WRITTEN.inc(posts_added, change='added')
+					metrics.POSTS_WRITTEN.inc(posts_updated, change='updated')
+					logger.info(
+						'Updated posts',
+						feed=self.title,
+						count=len(rows),
+						added=posts_added,
+						updated=posts_updated,
+					)
+					return posts_added + posts_updated > 0
 				except Exception as commit_exc:
 					logger.error('Session commit failed', feed=self.title, error=str(commit_exc))
 					session.rollback()
 					raise
 
-		except (ConnectionError, ConnectionResetError, TimeoutError, asyncio.TimeoutError) as e:
+		except (
+			ConnectionError,
+			ConnectionResetError,
+			TimeoutError,
+			asyncio.TimeoutError,
+			httpx.TransportError,
+		) as e:
 			error_msg = f'Connection error: {e}'
 			logger.error('Connection failed', feed=self.link, error=str(e))
+		except httpx.HTTPStatusError as e:
+			error_msg = f'HTTP error: {e.response.status_code}'
+			logger.error('HTTP error', feed=self.link, status=e.response.status_code)
 		except FeedParsingError as e:
 			error_msg = f'Malformed feed: {e}'
 			logger.error('Malformed feed', feed=self.link, error=str(e))
@@ -229,12 +323,12 @@ class Feed(SQLModel, table=True):
 			logger.error('Unexpected error in update_posts', feed=self.link, error=str(e))
 
 		if error_msg:
+			metrics.FETCHES.inc(outcome='error')
 			try:
 				with Session(engine) as session:
 					feed = session.get(Feed, self.link)
 					if feed:
-						feed.failure_count += 1
-						feed.last_error = error_msg[:500]
+						feed.record_failure(error_msg)
 						session.commit()
 						logger.warning(
 							'Feed failure count incremented',
@@ -248,10 +342,92 @@ class Feed(SQLModel, table=True):
 
 
 class Post(SQLModel, table=True):
-	__table_args__ = (Index('idx_post_publication_date', 'publication_date'),)
+	__table_args__ = (
+		Index('idx_post_publication_date', 'publication_date'),
+		Index('idx_post_feed_link_publication_date', 'feed_link', 'publication_date'),
+	)
 
 	link: str = Field(primary_key=True)
 	title: str
 	feed_link: str = Field(foreign_key='feed.link')
 	feed: Feed = Relationship(back_populates='posts')
 	publication_date: datetime
+
+	@classmethod
+	def upsert_many(cls, session: Session, rows: list[dict]) -> tuple[int, int]:
+		"""Insert or update posts in a single INSERT ... ON CONFLICT statement.
+
+		Rows whose title, feed and date are unchanged are left untouched.
+		Returns (added, updated) row counts.
+		"""
+		if not rows:
+			return 0, 0
+
+		# Last occurrence of a link wins, as it did with one merge per entry
+		rows = list({row['link']: row for row in rows}.values())
+		links = [row['link'] for row in rows]
+		existing = len(session.exec(select(cls.link).where(cls.link.in_(links))).all())
+
+		statement = sqlite_insert(cls).values(rows)
+		statement = statement.on_conflict_do_update(
+			index_elements=[cls.link],
+			set_={
+				'title': statement.excluded.title,
+				'feed_link': statement.excluded.feed_link,
+				'publication_date': statement.excluded.publication_date,
+			},
+			where=or_(
+				cls.title != statement.excluded.title,
+				cls.feed_link != statement.excluded.feed_link,
+				cls.publication_date != statement.excluded.publication_date,
+			),
+		)
+		changed = session.exec(statement).rowcount
+
+		added = len(rows) - existing
+		return added, changed - added
+
+	@classmethod
+	def delete_expired(cls, session: Session) -> int:
+		"""Apply retention in one DELETE: posts past RETENTION, and each feed's posts
+		beyond its max_posts newest. Returns the number of deleted rows.
+		"""
+		ranked = (
+			sa_select(
+				cls.link,
+				Feed.max_posts,
+				func.row_number()
+				.over(partition_by=cls.feed_link, order_by=cls.publication_date.desc())
+				.label('rank'),
+			)
+			.join(Feed, Feed.link == cls.feed_link)
+			.where(Feed.max_posts.is_not(None))
+			.subquery()
+		)
+		excess = sa_select(ranked.c.link).where(ranked.c.rank > ranked.c.max_posts)
+
+		statement = delete(cls).where(
+			or_(cls.publication_date < datetime.now() - RETENTION, cls.link.in_(excess))
+		)
+		return session.exec(statement).rowcount
+
+
+# Bump whenever a table or column changes; an on-disk store with another version is rebuilt
+SCHEMA_VERSION = 5
+
+
+def init_db() -> None:
+	"""Create the tables, rebuilding a persisted store whose schema is out of date."""
+	with engine.connect() as connection:
+		version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+	if version != SCHEMA_VERSION:
+		if version:
+			logger.warning(
+				'Store schema is outdated, rebuilding', found=version, expected=SCHEMA_VERSION
+			)
+		SQLModel.metadata.drop_all(engine)
+
+	SQLModel.metadata.create_all(engine)
+	with engine.begin() as connection:
+		connection.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSION}')
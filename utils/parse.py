@@ -0,0 +1,161 @@
+import asyncio
+import calendar
+import os
+import signal
+import statistics
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from io import BytesIO
+
+import feedparser
+
+# 'process' parses feeds in worker processes so feedparser's pure-Python XML/HTML
+# sanitising runs in parallel and off the event loop; 'thread' keeps it in-process.
+PARSE_EXECUTOR = os.getenv('PARSE_EXECUTOR', 'process').lower()
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '0')) or None
+
+# Number of recent entries used to estimate how often a feed publishes
+PUBLICATION_SAMPLE = 20
+
+# sy:updatePeriod values, in seconds
+_SY_PERIODS = {
+	'hourly': 3600,
+	'daily': 86400,
+	'weekly': 7 * 86400,
+	'monthly': 30 * 86400,
+	'yearly': 365 * 86400,
+}
+
+_executor: Executor | None = None
+
+
+@dataclass(slots=True)
+class ParsedEntry:
+	"""The few entry fields the ingest path uses, cheap to pickle across processes."""
+
+	link: str | None
+	title: str | None
+	id: str | None = None
+	published_parsed: time.struct_time | None = None
+	updated_parsed: time.struct_time | None = None
+	accesspermission: str = 'free'
+
+
+@dataclass(slots=True)
+class ParsedFeed:
+	link: str | None = None
+	title: str | None = None
+	subtitle: str = ''
+	image: str | None = None
+	bozo: bool = False
+	bozo_message: str | None = None
+	entries: list[ParsedEntry] = field(default_factory=list)
+	# Refresh hints, in seconds
+	ttl: int | None = None
+	publication_interval: float | None = None
+
+
+def _ttl(feed: feedparser.FeedParserDict) -> int | None:
+	"""Return the polling interval the feed asks for via <ttl> or sy:updatePeriod."""
+	hints = []
+	try:
+		hints.append(int(feed.get('ttl')) * 60)
+	except (TypeError, ValueError):
+		pass
+
+	period = _SY_PERIODS.get((feed.get('sy_updateperiod') or '').strip().lower())
+	if period:
+		try:
+			frequency = max(int(feed.get('sy_updatefrequency', 1)), 1)
+		except (TypeError, ValueError):
+			frequency = 1
+		hints.append(period // frequency)
+
+	return max(hints, default=None)
+
+
+def _publication_interval(entries: list[ParsedEntry]) -> float | None:
+	"""Return the median gap in seconds between the feed's most recent entries."""
+	stamps = sorted(
+		(
+			calendar.timegm(entry.published_parsed or entry.updated_parsed)
+			for entry in entries
+			if entry.published_parsed or entry.updated_parsed
+		),
+		reverse=True,
+	)[: PUBLICATION_SAMPLE + 1]
+	if len(stamps) < 3:
+		return None
+	return float(statistics.median(newer - older for newer, older in zip(stamps, stamps[1:])))
+
+
+def parse_feed(content: bytes, headers: dict[str, str] | None = None) -> ParsedFeed:
+	"""Parse raw feed bytes into a ParsedFeed. Runs inside the parse executor."""
+	# Wrap the body in a stream so feedparser never treats it as a path or URL
+	data = feedparser.parse(BytesIO(content), response_headers=headers)
+
+	bozo_message = None
+	if data.bozo:
+		bozo_message = getattr(
+			data.bozo_exception, 'getMessage', lambda: str(data.bozo_exception)
+		)()
+
+	entries = [
+		ParsedEntry(
+			link=entry.get('link'),
+			title=entry.get('title'),
+			id=entry.get('id'),
+			published_parsed=entry.get('published_parsed'),
+			updated_parsed=entry.get('updated_parsed'),
+			accesspermission=entry.get('accesspermission', 'free'),
+		)
+		for entry in data.entries
+	]
+
+	return ParsedFeed(
+		link=data.feed.get('link'),
+		title=data.feed.get('title'),
+		subtitle=data.feed.get('subtitle', ''),
+		image=getattr(data.feed.get('image'), 'href', None),
+		bozo=bool(data.bozo),
+		bozo_message=bozo_message,
+		entries=entries,
+		ttl=_ttl(data.feed),
+		publication_interval=_publication_interval(entries),
+	)
+
+
+def _init_worker() -> None:
+	# Ctrl+C reaches the whole process group; let the main process shut the pool down
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _get_executor() -> Executor:
+	global _executor
+	if _executor is None:
+		if PARSE_EXECUTOR == 'thread':
+			_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='parse')
+		else:
+			_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, initializer=_init_worker)
+	return _executor
+
+
+async def parse(content: bytes, headers: dict[str, str] | None = None) -> ParsedFeed:
+	"""Parse feed bytes in the configured executor without blocking the event loop."""
+	global _executor
+	loop = asyncio.get_running_loop()
+	try:
+		return await loop.run_in_executor(_get_executor(), parse_feed, content, headers)
+	except BrokenProcessPool:
+		# A worker died (e.g. OOM on a huge feed); start a fresh pool for the next call
+		_executor = None
+		raise
+
+
+def shutdown_executor() -> None:
+	global _executor
+	if _executor is not None:
+		_executor.shutdown(wait=False, cancel_futures=True)
+		_executor = None
@@ -0,0 +1,123 @@
+import cProfile
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from utils.logs import logger
+
+# Opt-in: set to a directory to record a span timeline of every refresh cycle there,
+# plus a cProfile dump of the cycles slower than PROFILE_SLOW_SECONDS
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+PROFILE_SLOW_SECONDS = float(os.getenv('PROFILE_SLOW_SECONDS', '60'))
+# Only the newest files of each kind are kept
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+
+TRACE_SUFFIX = '.trace.json'
+PROFILE_SUFFIX = '.prof'
+
+
+class Trace:
+	"""Spans of one cycle, saved in the Chrome trace event format (Perfetto, chrome://tracing)."""
+
+	def __init__(self):
+		self.start = time.perf_counter()
+		self.events: list[dict] = []
+		# One row in the viewer per lane: the cycle itself, then one per feed
+		self.lanes: dict[str, int] = {'cycle': 0}
+
+	def add(self, name: str, lane: str, start: float, end: float, args: dict) -> None:
+		self.events.append(
+			{
+				'name': name,
+				'ph': 'X',
+				'ts': round((start - self.start) * 1e6),
+				'dur': round((end - start) * 1e6),
+				'pid': 1,
+				'tid': self.lanes.setdefault(lane, len(self.lanes)),
+				'args': args,
+			}
+		)
+
+	def to_json(self) -> str:
+		names = [
+			{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': lane}}
+			for lane, tid in self.lanes.items()
+		]
+		return json.dumps({'traceEvents': names + self.events})
+
+
+_trace: ContextVar[Trace | None] = ContextVar('trace', default=None)
+_lane: ContextVar[str] = ContextVar('lane', default='cycle')
+
+
+@contextmanager
+def span(name: str, lane: str | None = None, **args):
+	"""Time a block as a span of the current cycle's trace. Free when profiling is off.
+
+	lane starts a new row in the timeline, e.g. one per feed; nested spans, including
+	those in tasks started inside the block, are drawn on the same row.
+	"""
+	trace = _trace.get()
+	if trace is None:
+		yield
+		return
+
+	token = _lane.set(lane) if lane else None
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		trace.add(name, _lane.get(), start, time.perf_counter(), args)
+		if token:
+			_lane.reset(token)
+
+
+def _rotate(suffix: str) -> None:
+	names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(suffix))
+	for name in names[:-PROFILE_KEEP]:
+		os.unlink(os.path.join(PROFILE_DIR, name))
+
+
+@contextmanager
+def profile_cycle():
+	"""Trace and profile a refresh cycle when PROFILE_DIR is set.
+
+	The profiler runs for every cycle, since whether a cycle is slow is only known once
+	it ends, but its output is only kept for the slow ones.
+	"""
+	if not PROFILE_DIR:
+		yield
+		return
+
+	trace = Trace()
+	token = _trace.set(trace)
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		with span('cycle'):
+			yield
+	finally:
+		profiler.disable()
+		_trace.reset(token)
+		duration = time.perf_counter() - trace.start
+
+		try:
+			os.makedirs(PROFILE_DIR, exist_ok=True)
+			prefix = os.path.join(PROFILE_DIR, datetime.now().strftime('%Y%m%d-%H%M%S'))
+			with open(prefix + TRACE_SUFFIX, 'w') as f:
+				f.write(trace.to_json())
+			_rotate(TRACE_SUFFIX)
+
+			if duration >= PROFILE_SLOW_SECONDS:
+				profiler.dump_stats(prefix + PROFILE_SUFFIX)
+				_rotate(PROFILE_SUFFIX)
+				logger.warning(
+					'Slow refresh cycle, profile saved',
+					duration=round(duration, 1),
+					profile=prefix + PROFILE_SUFFIX,
+				)
+		except OSError as e:
+			logger.error('Failed to save cycle profile', error=str(e))
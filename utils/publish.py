@@ -0,0 +1,62 @@
+import asyncio
+import os
+import tempfile
+
+from utils.logs import logger
+
+TEMP_SUFFIX = '.tmp'
+
+
+def _write_temp(path: str, data: bytes) -> str:
+	"""Write data to a fsynced temporary file next to path and return its name."""
+	directory, name = os.path.split(path)
+	fd, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix=TEMP_SUFFIX, dir=directory or '.')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		# mkstemp creates 0600 files; the web server needs to read them
+		os.chmod(temp_path, 0o644)
+	except BaseException:
+		os.unlink(temp_path)
+		raise
+	return temp_path
+
+
+def _fsync_directory(directory: str) -> None:
+	fd = os.open(directory or '.', os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+def publish_files(files: dict[str, bytes]) -> None:
+	"""Atomically replace every path in files with its new content.
+
+	All files are written and fsynced to temporary names first, then renamed
+	into place, so readers never see a truncated file and a crash before the
+	renames leaves the previous generation untouched.
+	"""
+	staged: dict[str, str] = {}
+	try:
+		for path, data in files.items():
+			staged[path] = _write_temp(path, data)
+	except BaseException:
+		for temp_path in staged.values():
+			os.unlink(temp_path)
+		raise
+
+	for path, temp_path in staged.items():
+		os.replace(temp_path, path)
+
+	for directory in {os.path.dirname(path) for path in staged}:
+		_fsync_directory(directory)
+
+	logger.debug('Published files', count=len(staged))
+
+
+async def publish(files: dict[str, bytes]) -> None:
+	"""Run publish_files off the event loop; fsync can block for a while."""
+	await asyncio.to_thread(publish_files, files)
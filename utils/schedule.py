@@ -0,0 +1,59 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+# How often the scheduler looks for feeds that are due
+SCHEDULER_TICK = 60
+
+# Bounds for each feed's own polling interval
+REFRESH_MIN = int(os.getenv('REFRESH_MIN_MINUTES', '5')) * 60
+REFRESH_MAX = int(os.getenv('REFRESH_MAX_MINUTES', '240')) * 60
+REFRESH_DEFAULT = 15 * 60
+
+# Spread polls of feeds with the same interval so they don't line up
+REFRESH_JITTER = 0.1
+
+# Circuit breaker: after this many consecutive failures a feed is only probed again
+# after an exponential, jittered backoff instead of on its regular interval
+BREAKER_THRESHOLD = 3
+BACKOFF_BASE = 10 * 60
+BACKOFF_MAX = 24 * 3600
+
+# Weight of the latest poll in the moving average of unchanged polls
+UNCHANGED_SMOOTHING = 0.2
+
+
+def update_unchanged_ratio(ratio: float, unchanged: bool) -> float:
+	"""Fold one poll into the moving average of polls that brought nothing new."""
+	return (1 - UNCHANGED_SMOOTHING) * ratio + UNCHANGED_SMOOTHING * unchanged
+
+
+def refresh_interval(
+	publication_interval: float | None,
+	unchanged_ratio: float,
+	server_interval: int | None,
+) -> int:
+	"""Return how many seconds to wait before polling a feed again.
+
+	Polls about twice per expected publication, backs off by up to 2x for feeds
+	that keep answering with nothing new, never polls sooner than the server
+	asked for (ttl, sy:updatePeriod, Cache-Control, Expires), and stays within
+	REFRESH_MIN..REFRESH_MAX.
+	"""
+	interval = publication_interval / 2 if publication_interval else REFRESH_DEFAULT
+	interval *= 1 + unchanged_ratio
+	if server_interval:
+		interval = max(interval, server_interval)
+	return int(min(max(interval, REFRESH_MIN), REFRESH_MAX))
+
+
+def next_fetch_at(interval: int) -> datetime:
+	jitter = random.uniform(1 - REFRESH_JITTER, 1 + REFRESH_JITTER)
+	return datetime.now() + timedelta(seconds=interval * jitter)
+
+
+def failure_backoff(failure_count: int) -> int:
+	"""Return the delay before probing a feed again, doubling with every failure."""
+	exponent = max(failure_count - BREAKER_THRESHOLD, 0)
+	delay = min(BACKOFF_BASE * 2**exponent, BACKOFF_MAX)
+	return int(delay * random.uniform(0.5, 1))
@@ -1,24 +1,38 @@
 import asyncio
+import gzip
 import hashlib
+import json
+import os
 import tomllib
 from datetime import datetime, timedelta
-
-import aiofiles
-import minify_html
-from jinja2 import Environment, FileSystemLoader
-from sqlalchemy.orm import selectinload
-from sqlmodel import Session, delete, select
-
-from utils import HTML_FILE, RSS_FILE, STATIC_DIR, TEMPLATES_DIR, engine
+from functools import lru_cache
+from typing import NamedTuple
+
+import brotli
+from sqlalchemy import func, or_
+from sqlalchemy import select as sa_select
+from sqlmodel import Session, delete, select, update
+
+from utils import (
+	HTML_FILE,
+	METRICS_FILE,
+	RSS_FILE,
+	STATIC_DIR,
+	STATUS_FILE,
+	engine,
+	metrics,
+	profiling,
+)
 from utils.logs import logger
-from utils.models import Feed, Post
-
-# Skip feeds that have failed more than this many times in a row
-MAX_CONSECUTIVE_FAILURES = 10
+from utils.models import BreakerState, Feed, Post
+from utils.publish import publish
+from utils.templates import create_environment
 
 # Reuse a single Jinja2 environment across updates
-_jinja_env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
-_jinja_env.filters['timeago'] = lambda dt: _timeago(dt)
+_jinja_env = create_environment()
+
+# Rendered post cards kept between builds; a day of posts fits comfortably
+FRAGMENT_CACHE_SIZE = 2048
 
 
 def _file_hash(path: str) -> str:
@@ -34,153 +48,336 @@ _js_hash = _file_hash(f'{STATIC_DIR}/js/index.min.js')
 with open(f'{STATIC_DIR}/csp-hash.txt') as _csp_file:
 	_csp_hash = _csp_file.read().strip()
 
+# Favicon sprite CSS from build_tools/build_sprite.py; without it, post cards fall back to
+# one image per source
+_favicons_css = f'{STATIC_DIR}/css/favicons.css'
+_jinja_env.globals['favicons_hash'] = (
+	_file_hash(_favicons_css) if os.path.exists(_favicons_css) else None
+)
+
+# Fingerprint of the post set behind the currently published pages
+_published_fingerprint: str | None = None
+
+# sha256 of each generated file as last written, keyed by path
+_output_digests: dict[str, str] = {}
+
+
+class PostRow(NamedTuple):
+	"""A post flattened with its feed: exactly what posts.html and feed.xml render."""
+
+	link: str
+	title: str
+	publication_date: datetime
+	feed_link: str
+	feed_title: str
+	feed_subtitle: str
+	feed_domain: str
+	feed_image: str
+
+
+_POSTS_QUERY = (
+	sa_select(
+		Post.link,
+		Post.title,
+		Post.publication_date,
+		Feed.link,
+		Feed.title,
+		Feed.subtitle,
+		Feed.domain,
+		Feed.image,
+	)
+	.join(Feed, Feed.link == Post.feed_link)
+	.order_by(Post.publication_date.desc())
+)
+
+
+def _posts_fingerprint(posts: list[PostRow]) -> str:
+	"""Hash everything the rendered pages depend on, apart from the current time."""
+	digest = hashlib.sha256(datetime.now().date().isoformat().encode())
+	for post in posts:
+		digest.update('\0'.join(map(str, post)).encode() + b'\n')
+	return digest.hexdigest()
+
+
+def _output_unchanged(path: str, data: bytes) -> bool:
+	"""Return True if path and its compressed sidecars already hold exactly this content."""
+	if not all(os.path.exists(path + ext) for ext in ('', '.br', '.gz')):
+		return False
+	if path not in _output_digests:
+		with open(path, 'rb') as f:
+			_output_digests[path] = hashlib.sha256(f.read()).hexdigest()
+	return _output_digests[path] == hashlib.sha256(data).hexdigest()
+
+
+def _compressed_variants(data: bytes) -> dict[str, bytes]:
+	"""Build the precompressed sidecars static-web-server picks up (compression-static)."""
+	return {
+		'.br': brotli.compress(data, quality=11),
+		'.gz': gzip.compress(data, compresslevel=9),
+	}
+
+
+def _fetch_priority(feed: Feed) -> tuple[float, float]:
+	return (feed.unchanged_ratio, feed.publication_interval or float('inf'))
+
 
 async def update_all_posts() -> None:
-	logger.info('Updating posts')
+	"""Refresh the feeds that are due, then republish once for all of their changes."""
 	with Session(engine) as session:
-		feeds = (session.exec(select(Feed))).all()
-
-	# Skip feeds with too many consecutive failures
-	active_feeds = []
-	for feed in feeds:
-		if feed.failure_count >= MAX_CONSECUTIVE_FAILURES:
-			logger.warning(
-				'Skipping feed due to repeated failures',
-				feed=feed.title,
-				failure_count=feed.failure_count,
+		feeds = session.exec(
+			select(Feed).where(or_(Feed.next_fetch.is_(None), Feed.next_fetch <= datetime.now()))
+		).all()
+	if not feeds:
+		logger.debug('No feed due for refresh')
+		return
+
+	with profiling.profile_cycle():
+		await _refresh_feeds(feeds)
+
+
+async def _update_feed(feed: Feed) -> bool:
+	with profiling.span('update_posts', lane=feed.link):
+		return await feed.update_posts()
+
+
+async def _refresh_feeds(feeds: list[Feed]) -> None:
+	logger.info('Updating posts', due=len(feeds))
+	cycle_start = datetime.now()
+
+	# Failing feeds whose backoff has expired get a single half-open probe
+	probes = [feed for feed in feeds if feed.breaker_state == BreakerState.OPEN]
+	if probes:
+		with Session(engine) as session:
+			session.exec(
+				update(Feed)
+				.where(Feed.link.in_([feed.link for feed in probes]))
+				.values(breaker_state=BreakerState.HALF_OPEN)
 			)
-			continue
-		active_feeds.append(feed)
-
-	tasks = [feed.update_posts() for feed in active_feeds]
-	results = await asyncio.gather(*tasks)
+			session.commit()
+		for feed in probes:
+			feed.breaker_state = BreakerState.HALF_OPEN
+			logger.info('Probing failing feed', feed=feed.link, failure_count=feed.failure_count)
+
+	# Fetch slots are handed out in task order: feeds that most often have news go first
+	feeds = sorted(feeds, key=_fetch_priority)
+	with profiling.span('update feeds', due=len(feeds)):
+		results = await asyncio.gather(*(_update_feed(feed) for feed in feeds))
 	has_new_content = any(results)
 	logger.info('Finished updating posts.', new_content=has_new_content)
 
-	# Delete entries older than a week
-	with Session(engine) as session:
+	# Delete entries older than a week and throttle feeds with a max_posts limit
+	with Session(engine) as session, metrics.CLEANUP_SECONDS.time(), profiling.span('cleanup'):
 		logger.debug('Running cleanup of old posts...')
-		statement = delete(Post).where(Post.publication_date < datetime.now() - timedelta(weeks=1))
-		session.exec(statement)
-
-		# Throttle feeds with max_posts limit
-		feeds_with_limit = session.exec(select(Feed).where(Feed.max_posts.is_not(None))).all()
-		for feed in feeds_with_limit:
-			excess_posts = session.exec(
-				select(Post)
-				.where(Post.feed_link == feed.link)
-				.order_by(Post.publication_date.desc())
-				.offset(feed.max_posts)
-			).all()
-			for post in excess_posts:
-				session.delete(post)
-
+		deleted = Post.delete_expired(session)
 		session.commit()
+		logger.debug('Cleanup done', deleted=deleted)
+	metrics.POSTS_DELETED.inc(deleted)
 
-	if has_new_content:
+	# Always check: posts also age out of the 24h window without any new content
+	with metrics.RENDER_SECONDS.time(), profiling.span('render'):
 		await update_served_files()
-	else:
-		logger.info('No new content, skipping static file regeneration.')
 
+	duration = (datetime.now() - cycle_start).total_seconds()
+	metrics.CYCLE_SECONDS.observe(duration)
+	metrics.LAST_CYCLE.set(datetime.now().timestamp())
+	with profiling.span('status'):
+		await publish_status(
+			{
+				'started_at': cycle_start.isoformat(timespec='seconds'),
+				'duration_seconds': round(duration, 3),
+				'due': len(feeds),
+				'new_content': has_new_content,
+				'deleted': deleted,
+			}
+		)
 
-def _timeago(dt: datetime) -> str:
-	delta = datetime.now() - dt
-	seconds = int(delta.total_seconds())
-	if seconds < 60:
-		return "À l'instant"
-	minutes = seconds // 60
-	if minutes < 60:
-		return f'Il y a {minutes} min'
-	hours = minutes // 60
-	if hours < 24:
-		return f'Il y a {hours}h'
-	days = hours // 24
-	return f'Il y a {days}j'
 
+async def publish_status(cycle: dict) -> None:
+	"""Write status.json and the Prometheus metrics file for the cycle that just ended."""
+	with Session(engine) as session:
+		feeds = session.exec(select(Feed)).all()
+		posts = session.exec(select(func.count()).select_from(Post)).one()
 
-async def update_served_files() -> None:
-	logger.info('Generating static files...')
+	states = {state: 0 for state in BreakerState}
+	for feed in feeds:
+		states[feed.breaker_state] += 1
+	for state, count in states.items():
+		metrics.FEEDS.set(count, state=state)
+	failing = [feed for feed in feeds if feed.failure_count]
+	metrics.FEEDS_FAILING.set(len(failing))
+	metrics.POSTS.set(posts)
+
+	status = {
+		'generated_at': datetime.now().isoformat(timespec='seconds'),
+		'cycle': cycle,
+		'feeds_total': len(feeds),
+		'feeds_failing': len(failing),
+		'posts': posts,
+		'fetches': {dict(key)['outcome']: count for key, count in metrics.FETCHES.values.items()},
+		'timings': {
+			name: histogram.summary()
+			for name, histogram in (
+				('fetch', metrics.FETCH_SECONDS),
+				('parse', metrics.PARSE_SECONDS),
+				('db', metrics.DB_SECONDS),
+				('cleanup', metrics.CLEANUP_SECONDS),
+				('render', metrics.RENDER_SECONDS),
+				('cycle', metrics.CYCLE_SECONDS),
+			)
+		},
+		# Failing feeds first, then the slowest
+		'feeds': [
+			{
+				'link': feed.link,
+				'title': feed.title,
+				'breaker_state': feed.breaker_state,
+				'failure_count': feed.failure_count,
+				'last_error': feed.last_error,
+				'last_success': feed.last_success
+				and feed.last_success.isoformat(timespec='seconds'),
+				'next_fetch': feed.next_fetch and feed.next_fetch.isoformat(timespec='seconds'),
+				'refresh_interval': feed.refresh_interval,
+				'fetch_seconds': round(metrics.feed_fetch_seconds.get(feed.link, 0.0), 3),
+			}
+			for feed in sorted(
+				feeds,
+				key=lambda feed: (
+					-feed.failure_count,
+					-metrics.feed_fetch_seconds.get(feed.link, 0.0),
+				),
+			)
+		],
+	}
 
-	with Session(engine) as session:
-		# Get posts from the last 24 hours
-		statement = (
-			select(Post)
-			.options(selectinload(Post.feed))
-			.where(Post.publication_date > datetime.now() - timedelta(days=1))
-			.order_by(Post.publication_date.desc())
+	try:
+		await publish(
+			{
+				STATUS_FILE: json.dumps(status, ensure_ascii=False).encode(),
+				METRICS_FILE: metrics.render_prometheus().encode(),
+			}
 		)
-		posts_last24h: list[Post] = session.exec(statement).all()
+	except Exception as e:
+		logger.error('Failed to write status files', error=str(e))
 
-		# Split posts from the last 24 hours into today and yesterday
-		posts_today: list[Post] = []
-		posts_yesterday: list[Post] = []
-		today_date = datetime.now().date()
 
-		for post in posts_last24h:
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _render_post(post: PostRow) -> str:
+	"""Render one post card. Cards carry no render-time state (index.js formats the
+	relative time), so a build only renders the posts that are new or edited."""
+	return _jinja_env.get_template('post.html').render(article=post)
+
+
+async def update_served_files() -> None:
+	global _published_fingerprint
+
+	# Get posts from the last 24 hours, split into today and yesterday in the same pass
+	posts_last24h: list[PostRow] = []
+	posts_today: list[PostRow] = []
+	posts_yesterday: list[PostRow] = []
+	today_date = datetime.now().date()
+
+	with engine.connect() as connection:
+		rows = connection.execute(
+			_POSTS_QUERY.where(Post.publication_date > datetime.now() - timedelta(days=1))
+		)
+		for row in rows:
+			post = PostRow(*row)
+			posts_last24h.append(post)
 			if post.publication_date.date() == today_date:
 				posts_today.append(post)
 			else:
 				posts_yesterday.append(post)
 
-		# Get all feeds
-		feeds = (session.exec(select(Feed).order_by(Feed.title.desc()))).all()
-
-		try:
-			template = _jinja_env.get_template('index.html')
-			index_html = template.render(
-				posts_today=posts_today,
-				posts_yesterday=posts_yesterday,
-				feeds=feeds,
-				plus=True,
-				css_hash=_css_hash,
-				js_hash=_js_hash,
-				canonical_url='https://insoumis.news/',
-				csp_hash=_csp_hash,
-				is_home=True,
-			)
+	fingerprint = _posts_fingerprint(posts_last24h)
+	if fingerprint == _published_fingerprint:
+		logger.info('Post set unchanged, skipping static file regeneration.')
+		return
+	logger.info('Generating static files...')
 
-			rss_template = _jinja_env.get_template('feed.xml')
-			rss_xml = rss_template.render(
-				posts=posts_last24h,
-				build_date=datetime.now().strftime('%a, %d %b %Y %H:%M:%S +0000'),
-			)
+	try:
+		template = _jinja_env.get_template('index.html')
+		index_html = template.render(
+			posts_today=[_render_post(post) for post in posts_today],
+			posts_yesterday=[_render_post(post) for post in posts_yesterday],
+			plus=True,
+			css_hash=_css_hash,
+			js_hash=_js_hash,
+			canonical_url='https://insoumis.news/',
+			csp_hash=_csp_hash,
+			is_home=True,
+		)
 
-			# minify_css must stay False: the inline <style> block is already compressed,
-			# and re-minifying it would change the bytes and invalidate the CSP sha256.
-			index_html = minify_html.minify(index_html, minify_css=False, minify_js=True)
-			rss_xml = minify_html.minify(rss_xml)
+		rss_template = _jinja_env.get_template('feed.xml')
+		rss_xml = rss_template.render(
+			posts=posts_last24h,
+			build_date=datetime.now().strftime('%a, %d %b %Y %H:%M:%S +0000'),
+		)
 
-			logger.debug('Pages rendered successfully')
-		except Exception as e:
-			logger.error('Failed to render template', error=str(e))
-			return
+		cache = _render_post.cache_info()
+		logger.debug(
+			'Pages rendered successfully', fragment_hits=cache.hits, fragment_misses=cache.misses
+		)
+	except Exception as e:
+		logger.error('Failed to render template', error=str(e))
+		return
 
 	try:
-		async with aiofiles.open(HTML_FILE, 'w') as f:
-			await f.write(index_html)
-		logger.debug('HTML file saved', path=HTML_FILE)
-
-		async with aiofiles.open(RSS_FILE, 'w') as f:
-			await f.write(rss_xml)
-		logger.debug('RSS feed saved', path=RSS_FILE)
-
+		files: dict[str, bytes] = {}
+		digests: dict[str, str] = {}
+		for path, content in ((HTML_FILE, index_html), (RSS_FILE, rss_xml)):
+			data = content.encode()
+			if _output_unchanged(path, data):
+				logger.debug('Output unchanged, not rewriting', path=path)
+				continue
+
+			# Compress off the event loop; brotli at quality 11 takes a while on a full page
+			variants = await asyncio.to_thread(_compressed_variants, data)
+			files[path] = data
+			files.update({path + ext: blob for ext, blob in variants.items()})
+			digests[path] = hashlib.sha256(data).hexdigest()
+
+		# Pages and sidecars of one generation become visible together
+		if files:
+			await publish(files)
+			_output_digests.update(digests)
+			logger.debug('Files saved', paths=list(digests))
+
+		_published_fingerprint = fingerprint
 	except Exception as e:
 		logger.error('Failed to save file', error=str(e))
 
 	logger.debug('Static files generation ended.')
 
 
-async def init_service() -> None:
+def init_service() -> None:
+	"""Register the feeds from gazette.toml. No network I/O: the scheduler fetches them."""
 	with open('gazette.toml', 'rb') as f:
 		config_data = tomllib.load(f)
 		logger.debug('Found feeds', count=len(config_data['feeds']['feedlist']))
 
 	logger.info('Initializing feeds...')
 	feedlist = config_data['feeds']['feedlist']
-	tasks = [Feed.init_feed(feed_dict) for feed_dict in feedlist]
-	results = await asyncio.gather(*tasks)
+	links = [feed_dict['link'] for feed_dict in feedlist]
+
+	# Feeds restored from a persisted store keep their posts and validators: only refresh
+	# their configuration and let the first cycle revalidate them with a conditional GET.
+	with Session(engine) as session:
+		session.exec(delete(Post).where(Post.feed_link.not_in(links)))
+		session.exec(delete(Feed).where(Feed.link.not_in(links)))
+
+		restored = 0
+		for feed_dict in feedlist:
+			feed = session.get(Feed, feed_dict['link'])
+			if feed is None:
+				session.add(Feed.from_config(feed_dict))
+			else:
+				feed.apply_config(feed_dict)
+				restored += 1
+		session.commit()
 
-	total = len(feedlist)
-	succeeded = sum(1 for r in results if r is not None)
-	failed = total - succeeded
-	logger.info('Feed initialization complete', total=total, succeeded=succeeded, failed=failed)
+	logger.info(
+		'Feed initialization complete',
+		total=len(feedlist),
+		restored=restored,
+		registered=len(feedlist) - restored,
+	)